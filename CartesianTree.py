@@ -2,11 +2,27 @@
 # -*- coding: utf-8 -*-
 
 
+def _unique(values):
+    '''Yield the sorted values without repetitions.'''
+    last = None
+    for i, value in enumerate(values):
+        if i == 0 or last < value:
+            yield value
+        last = value
+
+
 class CartesianTree:
     '''Build an ordered collection of unique elements. An order should be total.
     All the operations run in O(log n) time (average case). However,
     this data structure depends on random number generator, which may cause
     a slowdown to O(n) time on specially developed series of queries.
+    Every tree draws 64-bit priorities from its own generator, seeded with
+    the given seed or, by default, unpredictably. With hash_priorities=True
+    a priority is a salted hash of the value instead, so the shape of a tree
+    depends only on its contents. depth_statistics() helps to watch
+    the balance.
+    Read-only queries (membership, indexing, next, prev, bisect) walk the tree
+    top-down and never restructure it.
 
     >>> ct = CartesianTree([5, 2])
     >>> ct
@@ -60,29 +76,89 @@ class CartesianTree:
     Traceback (most recent call last):
     ...
     ValueError: no such element
+    >>> ct.bisect_left(5), ct.bisect_right(5), ct.rank(6)
+    (1, 2, 2)
+    >>> CartesianTree([3, 1, 2, 3, 1])
+    [1, 2, 3]
+    >>> CartesianTree.from_sorted(range(5))
+    [0, 1, 2, 3, 4]
+    >>> evens, odds = CartesianTree(range(0, 10, 2)), CartesianTree(range(1, 10, 2))
+    >>> evens.union(odds)
+    >>> evens, odds
+    ([0, 1, 2, 3, 4, 5, 6, 7, 8, 9], [])
+    >>> lo, hi = evens.split_at(7)
+    >>> lo, hi
+    ([0, 1, 2, 3, 4, 5, 6], [7, 8, 9])
+    >>> lo.difference(CartesianTree([1, 3, 5, 11]))
+    >>> lo
+    [0, 2, 4, 6]
+    >>> lo.intersection(CartesianTree([2, 3, 4]))
+    >>> lo
+    [2, 4]
+    >>> lo.concat(hi)
+    >>> lo
+    [2, 4, 7, 8, 9]
+    >>> lo.concat(CartesianTree([1]))
+    Traceback (most recent call last):
+    ...
+    ValueError: trees overlap
+    >>> numbers = CartesianTree(range(10))
+    >>> list(numbers.irange(3, 6)), list(numbers.irange(3, 6, inclusive=(False, False)))
+    ([3, 4, 5, 6], [4, 5])
+    >>> list(numbers.irange(hi=2)), list(numbers.irange(7, reverse=True))
+    ([0, 1, 2], [9, 8, 7])
+    >>> numbers.count_range(3, 6), numbers.count_range(3, 6, inclusive=(True, False))
+    (4, 3)
+    >>> numbers[2:5], numbers[::-3], numbers[-2:]
+    ([2, 3, 4], [9, 6, 3, 0], [8, 9])
+    >>> list(reversed(numbers))
+    [9, 8, 7, 6, 5, 4, 3, 2, 1, 0]
+    >>> hashed = CartesianTree(range(50), seed=7, hash_priorities=True)
+    >>> added = CartesianTree((), seed=7, hash_priorities=True)
+    >>> for value in reversed(range(50)):
+    ...     added.add(value)
+    >>> hashed.depth_statistics() == added.depth_statistics()
+    True
+    >>> height, average_depth = CartesianTree(range(1000), seed=1).depth_statistics()
+    >>> height < 50, average_depth < 20
+    (True, True)
+    >>> ct.remove(3)
+    Traceback (most recent call last):
+    ...
+    ValueError
     '''
 
-    class __Node:
+    import copy
+    import itertools
+    import random
+
+    PRIORITY_MASK = 2 ** 64 - 1
+
+    class _Node:
 
         '''Store a single value. All the values in the left subtree are less than ours. 
         All the values in the right subtree are greater than ours.
         '''
 
-        import random
-
-        random.seed(43670)
+        __slots__ = ('value', 'left', 'right', 'priority', 'size')
 
-        RANDOMRANGE = 2 ** 16
+        count = 1   # multiplicity of the value, see CartesianMultiset
 
-        def __init__(self, value):
+        def __init__(self, value, priority):
             self.value = value
             self.left = None
             self.right = None
-            self.priority = self.random.randrange(0, self.RANDOMRANGE)
+            self.priority = priority
             self.size = 1
 
-        def __recalc(self):
-            self.size = self.sizeof(self.left) + 1 + self.sizeof(self.right)
+        def _recalc(self):
+            self.size = self.sizeof(self.left) + self.count + self.sizeof(self.right)
+
+        def _writable(self):
+            '''Return a node which may be modified in place: the node itself,
+            or its copy if the nodes are shared between versions of a tree.
+            '''
+            return self
 
         @classmethod
         def split(cls, node, value):
@@ -98,17 +174,17 @@ class CartesianTree:
             elif node.value < value:
                 left, center, right = cls.split(node.right, value)
                 node.right = left
-                node.__recalc()
+                node._recalc()
                 return node, center, right
             elif node.value == value:
                 left, center, right = node.left, node, node.right
                 node.left = node.right = None
-                node.__recalc()
+                node._recalc()
                 return left, center, right
             else:
                 left, center, right = cls.split(node.left, value)
                 node.left = right
-                node.__recalc()
+                node._recalc()
                 return left, center, node
 
         @classmethod
@@ -132,54 +208,212 @@ class CartesianTree:
                 return left
             elif left.priority > right.priority:
                 left.right = cls.merge(left.right, right)
-                left.__recalc()
+                left._recalc()
                 return left
             else:
                 right.left = cls.merge(left, right.left)
-                right.__recalc()
+                right._recalc()
                 return right
 
+        @classmethod
+        def union(cls, first, second):
+            '''Return a tree of the values from both subtrees. The root with
+            the higher priority stays a root, the other subtree is split by
+            its value, so the time is O(m log(n/m + 1)) for subtrees of sizes
+            m <= n. Of two nodes with equal values the one from the second
+            subtree is kept. Don't use the references 'first' and 'second'
+            afterwards.
+            '''
+            if first is None:
+                return second
+            elif second is None:
+                return first
+            swapped = first.priority < second.priority
+            if swapped:
+                first, second = second, first
+            left, center, right = cls.split(second, first.value)
+            root = first._writable()
+            if center is not None and not swapped:
+                center.priority = first.priority
+                root = center
+            if swapped:
+                root.left = cls.union(left, first.left)
+                root.right = cls.union(right, first.right)
+            else:
+                root.left = cls.union(first.left, left)
+                root.right = cls.union(first.right, right)
+            root._recalc()
+            return root
+
+        @classmethod
+        def intersection(cls, first, second):
+            '''Return a tree of the values present in both subtrees, see union.
+            Of two nodes with equal values the one from the first subtree
+            is kept, whichever root has the higher priority.
+            '''
+            if first is None or second is None:
+                return None
+            swapped = first.priority < second.priority
+            if swapped:
+                first, second = second, first
+            left, center, right = cls.split(second, first.value)
+            if swapped:
+                left = cls.intersection(left, first.left)
+                right = cls.intersection(right, first.right)
+            else:
+                left = cls.intersection(first.left, left)
+                right = cls.intersection(first.right, right)
+            if center is None:
+                return cls.merge(left, right)
+            root = first._writable()
+            if swapped:
+                center.priority = root.priority
+                root = center
+            root.left, root.right = left, right
+            root._recalc()
+            return root
+
+        @classmethod
+        def difference(cls, first, second):
+            '''Return a tree of the values of the first subtree which are absent
+            from the second one, see union.
+            '''
+            if first is None or second is None:
+                return first
+            elif first.priority < second.priority:
+                left, center, right = cls.split(first, second.value)
+                return cls.merge(cls.difference(left, second.left),
+                                 cls.difference(right, second.right))
+            left, center, right = cls.split(second, first.value)
+            left = cls.difference(first.left, left)
+            right = cls.difference(first.right, right)
+            if center is not None:
+                return cls.merge(left, right)
+            first = first._writable()
+            first.left, first.right = left, right
+            first._recalc()
+            return first
+
         @classmethod
         def sizeof(cls, node):
             return node.size if node is not None else 0
-            
+
+        @classmethod
+        def build(cls, nodes):
+            '''Return a tree of the given single nodes in O(n) time. Their values
+            should be strictly increasing. The right spine of the tree built
+            so far is kept on a stack: every new node takes the popped part
+            of the spine with lower priorities as its left subtree.
+            '''
+            stack = []
+            for node in nodes:
+                last = None
+                while stack and stack[-1].priority <= node.priority:
+                    last = stack.pop()
+                    last._recalc()
+                node.left = last
+                if stack:
+                    stack[-1].right = node
+                stack.append(node)
+            while len(stack) > 1:
+                stack.pop()._recalc()
+            if not stack:
+                return None
+            stack[0]._recalc()
+            return stack[0]
+
+        @classmethod
+        def find(cls, node, value):
+            '''Return the node with the passed value or None.
+            The tree is not modified.
+            '''
+            while node is not None:
+                if node.value < value:
+                    node = node.right
+                elif node.value == value:
+                    return node
+                else:
+                    node = node.left
+            return None
+
         def get_kth_node(self, k):
             if k < 0:
                 k = self.size + k
             if not (0 <= k < self.size):
                 raise IndexError('index out of range')
-            left_size = self.sizeof(self.left)
-            if left_size == k:
-                return self
-            elif left_size > k:
-                return self.left.get_kth_node(k)
-            else:
-                return self.right.get_kth_node(k - left_size - 1)
+            node = self
+            while True:
+                left_size = self.sizeof(node.left)
+                if left_size > k:
+                    node = node.left
+                elif k < left_size + node.count:
+                    return node
+                else:
+                    k -= left_size + node.count
+                    node = node.right
 
         def __repr__(self):
             return '[{0}] {1} (len={2}) [{3}]'.format(self.left, self.value, self.size, self.right)
 
-    def __init__(self, values):
-        self.__root = None
-        for value in values:
-            self.add(value)
+    def __init__(self, values, seed=None, hash_priorities=False):
+        '''Build a tree of the given values in O(n log n) time for sorting them,
+        the tree itself is built in linear time.
+        '''
+        self.__random = self.random.Random(seed)
+        self.__salt = self.__random.getrandbits(64) if hash_priorities else None
+        self._root = self._Node.build(map(self._new_node, _unique(sorted(values))))
+
+    @classmethod
+    def from_sorted(cls, values, seed=None, hash_priorities=False):
+        '''Build a tree in O(n) time. The values should be strictly increasing,
+        which is not checked.
+        '''
+        tree = cls((), seed, hash_priorities)
+        tree._root = tree._Node.build(map(tree._new_node, values))
+        return tree
+
+    def _priority(self, value):
+        if self.__salt is None:
+            return self.__random.getrandbits(64)
+        x = hash((self.__salt, value)) & self.PRIORITY_MASK
+        x = (x ^ (x >> 30)) * 0xbf58476d1ce4e5b9 & self.PRIORITY_MASK
+        x = (x ^ (x >> 27)) * 0x94d049bb133111eb & self.PRIORITY_MASK
+        return x ^ (x >> 31)
+
+    def _new_node(self, value, *args):
+        return self._Node(value, self._priority(value), *args)
+
+    def depth_statistics(self):
+        '''Return a pair (height, average depth of a node) in O(n) time.
+        Both are about 2 ln n for a balanced tree and the height is n
+        in the worst case. The root has depth 1.
+        '''
+        height = total = count = 0
+        stack = [(self._root, 1)] if self._root is not None else []
+        while stack:
+            node, depth = stack.pop()
+            height = max(height, depth)
+            total += depth
+            count += 1
+            for child in node.left, node.right:
+                if child is not None:
+                    stack.append((child, depth + 1))
+        return height, total / count if count else 0.0
 
     def add(self, value):
-        if value not in self:
-            left, center, right = self.__Node.split(self.__root, value)
-            self.__root = self.__Node.merge(left, self.__Node(value), right)
+        left, center, right = self._Node.split(self._root, value)
+        if center is None:
+            center = self._new_node(value)
+        self._root = self._Node.merge(left, center, right)
 
     def __contains__(self, value):
-        left, center, right = self.__Node.split(self.__root, value)
-        retval = center is not None
-        self.__root = self.__Node.merge(left, center, right)
-        return retval
+        return self._Node.find(self._root, value) is not None
 
     def remove(self, value):
-        if value not in self:
+        left, center, right = self._Node.split(self._root, value)
+        self._root = self._Node.merge(left, right)
+        if center is None:
             raise ValueError()
-        left, center, right = self.__Node.split(self.__root, value)
-        self.__root = self.__Node.merge(left, right)
 
     def discard(self, value):
         try:
@@ -187,41 +421,1337 @@ class CartesianTree:
         except ValueError:
             pass
 
+    def _empty(self):
+        '''Return an empty tree of the same kind.'''
+        tree = self.copy.copy(self)
+        tree._root = None
+        return tree
+
+    def __take_root(self, other):
+        if not isinstance(other, CartesianTree):
+            raise TypeError('expected a cartesian tree, got {0}'.format(type(other).__name__))
+        root, other._root = other._root, None
+        return root
+
+    def union(self, other):
+        '''Add all the elements of other tree to this one. The nodes are moved,
+        not copied: other tree becomes empty.
+        Runs in O(m log(n/m + 1)) time, where m <= n are the sizes of the trees.
+        '''
+        if other is not self:
+            self._root = self._Node.union(self._root, self.__take_root(other))
+
+    def intersection(self, other):
+        '''Keep only the elements which are present in other tree as well.
+        The nodes of this tree are kept, with their payloads if any.
+        Other tree becomes empty, see union.
+        '''
+        if other is not self:
+            self._root = self._Node.intersection(self._root, self.__take_root(other))
+
+    def difference(self, other):
+        '''Remove all the elements of other tree from this one.
+        Other tree becomes empty, see union.
+        '''
+        self._root = self._Node.difference(self._root, self.__take_root(other))
+
+    def split_at(self, value):
+        '''Return a pair of trees (lo, hi): lo contains the elements less than
+        the passed value, hi contains the rest. Runs in O(log n) time.
+        This tree becomes empty.
+        '''
+        left, center, right = self._Node.split(self.__take_root(self), value)
+        lo, hi = self._empty(), self._empty()
+        lo._root, hi._root = left, self._Node.merge(center, right)
+        return lo, hi
+
+    def concat(self, other):
+        '''Append all the elements of other tree, which should be greater than
+        all the elements of this one. Runs in O(log n) time.
+        Other tree becomes empty.
+        '''
+        root = self.__take_root(other)
+        if (self._root is not None and root is not None and
+                not self._root.get_kth_node(-1).value < root.get_kth_node(0).value):
+            other._root = root
+            raise ValueError('trees overlap')
+        self._root = self._Node.merge(self._root, root)
+
     def __len__(self):
-        return self.__Node.sizeof(self.__root)
+        return self._Node.sizeof(self._root)
 
     def __getitem__(self, index):
+        if isinstance(index, slice):
+            indices = range(*index.indices(len(self)))
+            if not indices:
+                return []
+            stack = self._stack_to_kth(indices[0], indices.step < 0)
+            nodes = self.itertools.islice(self._walk(stack, indices.step < 0),
+                                          0, abs(indices[-1] - indices[0]) + 1,
+                                          abs(indices.step))
+            return [node.value for node in nodes]
         if not isinstance(index, int):
             raise TypeError('cartesian tree indices must be integers')
-        if self.__root is None:
+        if self._root is None:
             raise IndexError('index out of range')
-        return self.__root.get_kth_node(index).value
+        return self._root.get_kth_node(index).value
+
+    @staticmethod
+    def _walk(stack, reverse=False):
+        '''Yield the nodes in order (or in reverse order), starting from the top
+        of the stack. The stack should hold the next node to visit on top of
+        its ancestors which are visited later.
+        '''
+        while stack:
+            node = stack.pop()
+            yield node
+            node = node.left if reverse else node.right
+            while node is not None:
+                stack.append(node)
+                node = node.right if reverse else node.left
+
+    def _stack_to_kth(self, k, reverse=False):
+        node, stack = self._root, []
+        while node is not None:
+            left_size = self._Node.sizeof(node.left)
+            if left_size > k:
+                if not reverse:
+                    stack.append(node)
+                node = node.left
+            elif k < left_size + node.count:
+                stack.append(node)
+                break
+            else:
+                if reverse:
+                    stack.append(node)
+                k -= left_size + node.count
+                node = node.right
+        return stack
+
+    @staticmethod
+    def _node_values(nodes):
+        return (node.value for node in nodes)
+
+    def __iter__(self):
+        return self._node_values(self._walk(self._stack_to_kth(0)))
+
+    def __reversed__(self):
+        stack = self._stack_to_kth(len(self) - 1, reverse=True)
+        return self._node_values(self._walk(stack, reverse=True))
+
+    def irange(self, lo=None, hi=None, inclusive=(True, True), reverse=False):
+        '''Lazily yield the elements between lo and hi in order (or in reverse
+        order). None stands for an unbounded side of the range.
+        Each step takes O(1) amortized time, the first one takes O(log n).
+        '''
+        return self._node_values(self.__irange_nodes(lo, hi, inclusive, reverse))
+
+    def __irange_nodes(self, lo, hi, inclusive, reverse):
+        start, stop = (hi, lo) if reverse else (lo, hi)
+        start_inclusive, stop_inclusive = inclusive[::-1] if reverse else inclusive
+        node, stack = self._root, []
+        while node is not None:
+            if start is None:
+                after_start = True
+            elif reverse:
+                after_start = node.value < start or start_inclusive and node.value == start
+            else:
+                after_start = start < node.value or start_inclusive and node.value == start
+            if after_start:
+                stack.append(node)
+                node = node.right if reverse else node.left
+            else:
+                node = node.left if reverse else node.right
+        for node in self._walk(stack, reverse):
+            value = node.value
+            if stop is not None:
+                if reverse:
+                    before_stop = stop < value or stop_inclusive and value == stop
+                else:
+                    before_stop = value < stop or stop_inclusive and value == stop
+                if not before_stop:
+                    return
+            yield node
+
+    def count_range(self, lo=None, hi=None, inclusive=(True, True)):
+        '''Return the number of elements between lo and hi in O(log n) time,
+        see irange.
+        '''
+        lo_inclusive, hi_inclusive = inclusive
+        if hi is None:
+            count = len(self)
+        else:
+            count = self.bisect_right(hi) if hi_inclusive else self.bisect_left(hi)
+        if lo is not None:
+            count -= self.bisect_left(lo) if lo_inclusive else self.bisect_right(lo)
+        return max(count, 0)
 
     def next(self, value):
-        left, center, right = self.__Node.split(self.__root, value)
-        try:
-            if self.__Node.sizeof(right) == 0:
-                raise ValueError('no such element')
+        '''Return the least element which is greater than the passed value.'''
+        node, found = self._root, None
+        while node is not None:
+            if value < node.value:
+                found, node = node, node.left
             else:
-                retval = right.get_kth_node(0).value
-        finally:
-            self.__root = self.__Node.merge(left, center, right)
-        return retval
+                node = node.right
+        if found is None:
+            raise ValueError('no such element')
+        return found.value
 
     def prev(self, value):
-        left, center, right = self.__Node.split(self.__root, value)
+        '''Return the greatest element which is less than the passed value.'''
+        node, found = self._root, None
+        while node is not None:
+            if node.value < value:
+                found, node = node, node.right
+            else:
+                node = node.left
+        if found is None:
+            raise ValueError('no such element')
+        return found.value
+
+    def bisect_left(self, value):
+        '''Return the number of elements which are less than the passed value.'''
+        node, rank = self._root, 0
+        while node is not None:
+            if node.value < value:
+                rank += self._Node.sizeof(node.left) + node.count
+                node = node.right
+            else:
+                node = node.left
+        return rank
+
+    rank = bisect_left
+
+    def bisect_right(self, value):
+        '''Return the number of elements which are not greater than the passed value.'''
+        node, rank = self._root, 0
+        while node is not None:
+            if value < node.value:
+                node = node.left
+            else:
+                rank += self._Node.sizeof(node.left) + node.count
+                node = node.right
+        return rank
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class AugmentedCartesianTree(CartesianTree):
+    '''Build an ordered collection of unique keys, each carrying a payload,
+    and maintain the aggregate of payloads over every subtree.
+    Operation should be associative; it is applied to payloads in the order
+    of their keys. Unless mapping is True, the payload of a key is the key
+    itself, otherwise the iterable should consist of (key, payload) pairs.
+    The aggregate over a range of keys is computed in O(log n) time.
+    Set operations (union, intersection, ...) should be applied to trees
+    with the same operation only. For a key present in both trees, union
+    keeps the payload of the other tree, intersection keeps the payload of
+    this one.
+
+    >>> at = AugmentedCartesianTree([5, 2, 8, 1], int.__add__)
+    >>> at
+    AugmentedCartesianTree([1, 2, 5, 8], int.__add__)
+    >>> at.aggregate(2, 8)
+    15
+    >>> at.add(4)
+    >>> at.aggregate(2, 5, inclusive=(True, False))
+    6
+    >>> at.aggregate()
+    20
+    >>> at.remove(5)
+    >>> at.aggregate(hi=4)
+    7
+    >>> at.aggregate(6, 7)
+    Traceback (most recent call last):
+    ...
+    ValueError: empty range
+    >>> prices = AugmentedCartesianTree([('b', 3), ('a', 5), ('c', 4), ('a', 6)], min, mapping=True)
+    >>> prices
+    AugmentedCartesianTree([('a', 6), ('b', 3), ('c', 4)], min, mapping=True)
+    >>> prices.aggregate('a', 'b'), prices.aggregate('c')
+    (3, 4)
+    >>> prices.add('b', 7)
+    >>> prices.aggregate('a', 'b'), prices.get('b'), prices.get('d', 0)
+    (6, 7, 0)
+    >>> s = AugmentedCartesianTree.from_sorted(['x', 'y', 'z'], str.__add__)
+    >>> s.aggregate('x', 'y'), s.aggregate(lo='x', inclusive=(False, True))
+    ('xy', 'yz')
+    >>> ones = AugmentedCartesianTree([(key, 1) for key in range(10)], int.__add__, mapping=True)
+    >>> ones.intersection(AugmentedCartesianTree([(key, 100) for key in range(0, 20, 2)],
+    ...                                          int.__add__, mapping=True))
+    >>> ones.aggregate(), list(ones.items())[:2]
+    (5, [(0, 1), (2, 1)])
+    '''
+
+    from operator import itemgetter
+
+    class _Node(CartesianTree._Node):
+
+        '''Store a key with its payload and the aggregate of the payloads
+        over the subtree. Trees derive a subclass with their operation.
+        '''
+
+        __slots__ = ('payload', 'aggregate')
+
+        operation = None
+
+        def __init__(self, value, priority, payload):
+            super().__init__(value, priority)
+            self.payload = payload
+            self.aggregate = payload
+
+        def _recalc(self):
+            super()._recalc()
+            aggregate = self.payload
+            if self.left is not None:
+                aggregate = self.operation(self.left.aggregate, aggregate)
+            if self.right is not None:
+                aggregate = self.operation(aggregate, self.right.aggregate)
+            self.aggregate = aggregate
+
+    def __init__(self, iterable, operation, mapping=False, seed=None, hash_priorities=False):
+        self.operation = operation
+        self.mapping = mapping
+        self._Node = type('_Node', (AugmentedCartesianTree._Node,),
+                          {'operation': staticmethod(operation), '__slots__': ()})
+        super().__init__((), seed, hash_priorities)
+        items = iterable if mapping else ((value, value) for value in iterable)
+        items = self.__unique(sorted(items, key=self.itemgetter(0)))
+        self._root = self._Node.build(self._new_node(key, payload) for key, payload in items)
+
+    @classmethod
+    def from_sorted(cls, iterable, operation, mapping=False, seed=None, hash_priorities=False):
+        '''Build a tree in O(n) time. The keys should be strictly increasing,
+        which is not checked.
+        '''
+        tree = cls((), operation, mapping, seed, hash_priorities)
+        items = iterable if mapping else ((value, value) for value in iterable)
+        tree._root = tree._Node.build(tree._new_node(key, payload) for key, payload in items)
+        return tree
+
+    @staticmethod
+    def __unique(items):
+        '''Keep the last pair from each run of pairs with equal keys.'''
+        previous = None
+        for i, item in enumerate(items):
+            if i > 0 and previous[0] < item[0]:
+                yield previous
+            previous = item
+        if previous is not None:
+            yield previous
+
+    def add(self, key, payload=None):
+        '''Add a key or replace its payload. The payload is ignored
+        unless the tree is a mapping.
+        '''
+        if not self.mapping:
+            payload = key
+        left, center, right = self._Node.split(self._root, key)
+        if center is None:
+            center = self._new_node(key, payload)
+        else:
+            center.payload = payload
+            center._recalc()
+        self._root = self._Node.merge(left, center, right)
+
+    def get(self, key, default=None):
+        node = self._Node.find(self._root, key)
+        return default if node is None else node.payload
+
+    def items(self):
+        return ((node.value, node.payload) for node in self._walk(self._stack_to_kth(0)))
+
+    def aggregate(self, lo=None, hi=None, inclusive=(True, True)):
+        '''Return the aggregate of the payloads of the keys between lo and hi,
+        see irange. Raise ValueError if there are no such keys.
+        '''
+        lo_inclusive, hi_inclusive = inclusive
+        op = self.operation
+
+        def after_lo(key):
+            return lo is None or lo < key or lo_inclusive and key == lo
+
+        def before_hi(key):
+            return hi is None or key < hi or hi_inclusive and key == hi
+
+        node = self._root
+        while node is not None:
+            if not after_lo(node.value):
+                node = node.right
+            elif not before_hi(node.value):
+                node = node.left
+            else:
+                break
+        if node is None:
+            raise ValueError('empty range')
+
+        result = node.payload
+        subtree = node.left
+        while subtree is not None:
+            if after_lo(subtree.value):
+                part = subtree.payload
+                if subtree.right is not None:
+                    part = op(part, subtree.right.aggregate)
+                result = op(part, result)
+                subtree = subtree.left
+            else:
+                subtree = subtree.right
+        subtree = node.right
+        while subtree is not None:
+            if before_hi(subtree.value):
+                part = subtree.payload
+                if subtree.left is not None:
+                    part = op(subtree.left.aggregate, part)
+                result = op(result, part)
+                subtree = subtree.right
+            else:
+                subtree = subtree.left
+        return result
+
+    def __repr__(self):
+        if '__objclass__' in dir(self.operation):
+            methodname = self.operation.__objclass__.__name__ + '.' + self.operation.__name__
+        else:
+            methodname = self.operation.__name__
+        if self.mapping:
+            return 'AugmentedCartesianTree({0}, {1}, mapping=True)'.format(list(self.items()), methodname)
+        return 'AugmentedCartesianTree({0}, {1})'.format(list(self), methodname)
+
+
+class CartesianMultiset(CartesianTree):
+    '''Build an ordered collection of elements with repetitions. Every node
+    stores a value with its multiplicity, and the size of a subtree is
+    the total multiplicity of its values, so indexing and bisection count
+    every copy of a value.
+
+    >>> ms = CartesianMultiset([5, 2, 5, 7, 5])
+    >>> ms
+    CartesianMultiset([2, 5, 5, 5, 7])
+    >>> len(ms), ms.count(5), ms.count(3)
+    (5, 3, 0)
+    >>> ms.add(2, 2)
+    >>> ms[:4], ms[-2], ms.bisect_left(5), ms.bisect_right(5)
+    ([2, 2, 2, 5], 5, 3, 6)
+    >>> ms.remove(5)
+    >>> list(ms.irange(3, 7, inclusive=(True, False))), ms.count_range(2, 5)
+    ([5, 5], 5)
+    >>> ms.remove(2, 3)
+    >>> ms, 2 in ms
+    (CartesianMultiset([5, 5, 7]), False)
+    >>> list(reversed(ms))
+    [7, 5, 5]
+    >>> ms.remove(5, 3)
+    Traceback (most recent call last):
+    ...
+    ValueError: not enough elements
+    >>> ms.add(3, 0)
+    Traceback (most recent call last):
+    ...
+    ValueError: count should be positive
+    '''
+
+    class _Node(CartesianTree._Node):
+
+        '''Store a value with its multiplicity.'''
+
+        __slots__ = ('count',)
+
+        def __init__(self, value, priority, count=1):
+            super().__init__(value, priority)
+            self.count = count
+            self.size = count
+
+    def __init__(self, values, seed=None, hash_priorities=False):
+        super().__init__((), seed, hash_priorities)
+        self._root = self._Node.build(self.__runs(sorted(values)))
+
+    @classmethod
+    def from_sorted(cls, values, seed=None, hash_priorities=False):
+        '''Build a multiset in O(n) time. The values should be non-decreasing,
+        which is not checked.
+        '''
+        multiset = cls((), seed, hash_priorities)
+        multiset._root = multiset._Node.build(multiset.__runs(values))
+        return multiset
+
+    def __runs(self, values):
+        node = None
+        for value in values:
+            if node is not None and not node.value < value:
+                node.count += 1
+                node.size += 1
+            else:
+                if node is not None:
+                    yield node
+                node = self._new_node(value)
+        if node is not None:
+            yield node
+
+    def add(self, value, count=1):
+        if count < 1:
+            raise ValueError('count should be positive')
+        left, center, right = self._Node.split(self._root, value)
+        if center is None:
+            center = self._new_node(value, count)
+        else:
+            center.count += count
+            center._recalc()
+        self._root = self._Node.merge(left, center, right)
+
+    def remove(self, value, count=1):
+        '''Remove count copies of the value. Raise ValueError and leave
+        the multiset intact if there are fewer copies.
+        '''
+        if count < 1:
+            raise ValueError('count should be positive')
+        left, center, right = self._Node.split(self._root, value)
+        if center is None or center.count < count:
+            self._root = self._Node.merge(left, center, right)
+            raise ValueError('not enough elements')
+        center.count -= count
+        center._recalc()
+        if center.count == 0:
+            center = None
+        self._root = self._Node.merge(left, center, right)
+
+    def count(self, value):
+        node = self._Node.find(self._root, value)
+        return 0 if node is None else node.count
+
+    @staticmethod
+    def _node_values(nodes):
+        return (node.value for node in nodes for i in range(node.count))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return super().__getitem__(index)
+
+    def union(self, other):
+        raise TypeError('set operations are not defined for multisets')
+
+    intersection = difference = union
+
+    def __repr__(self):
+        return 'CartesianMultiset({0})'.format(list(self))
+
+
+class CartesianMap(CartesianTree):
+    '''Build a mapping with keys kept in order. Keys are handled as the values
+    of CartesianTree: next, prev, irange, bisect and the like work on keys.
+    Item access goes by key, like in dict; use peekitem for access by index.
+
+    >>> cm = CartesianMap([(5, 'five'), (2, 'two')])
+    >>> cm
+    CartesianMap([(2, 'two'), (5, 'five')])
+    >>> cm[7] = 'seven'
+    >>> cm[5], cm.get(3), 7 in cm, len(cm)
+    ('five', None, True, 3)
+    >>> cm.setdefault(3, 'three'), cm.setdefault(5, 'FIVE')
+    ('three', 'five')
+    >>> cm.floor_key(4), cm.floor_key(5), cm.ceiling_key(6), cm.peekitem(-1)
+    (3, 5, 7, (7, 'seven'))
+    >>> cm.pop(3), cm.pop(3, None)
+    ('three', None)
+    >>> cm.update({1: 'one', 2: 'TWO'})
+    >>> list(cm.items())
+    [(1, 'one'), (2, 'TWO'), (5, 'five'), (7, 'seven')]
+    >>> del cm[5]
+    >>> list(cm.keys()), list(cm.values())
+    ([1, 2, 7], ['one', 'TWO', 'seven'])
+    >>> cm[4]
+    Traceback (most recent call last):
+    ...
+    KeyError: 4
+    >>> cm.floor_key(0)
+    Traceback (most recent call last):
+    ...
+    KeyError: 'no such key'
+    >>> cm.intersection(CartesianMap([(2, 'two'), (3, 'three'), (7, 'SEVEN')]))
+    >>> cm
+    CartesianMap([(2, 'TWO'), (7, 'seven')])
+    '''
+
+    __marker = object()
+
+    class _Node(CartesianTree._Node):
+
+        '''Store a key (as the value of CartesianTree) with its payload.'''
+
+        __slots__ = ('payload',)
+
+        def __init__(self, value, priority, payload):
+            super().__init__(value, priority)
+            self.payload = payload
+
+    def __init__(self, items=(), seed=None, hash_priorities=False):
+        super().__init__((), seed, hash_priorities)
+        self.update(items)
+
+    @classmethod
+    def from_sorted(cls, items, seed=None, hash_priorities=False):
+        '''Build a map in O(n) time. The keys should be strictly increasing,
+        which is not checked.
+        '''
+        mapping = cls((), seed, hash_priorities)
+        mapping._root = mapping._Node.build(mapping._new_node(key, payload) for key, payload in items)
+        return mapping
+
+    def update(self, items):
+        '''Add the (key, payload) pairs or the items of a mapping, replacing
+        the payloads of existing keys. A tree of the new items is built
+        in linear time after sorting and then united with this one.
+        '''
+        if hasattr(items, 'items'):
+            items = items.items()
+        nodes = []
+        for key, payload in sorted(items, key=lambda item: item[0]):
+            if nodes and not nodes[-1].value < key:
+                nodes[-1].payload = payload
+            else:
+                nodes.append(self._new_node(key, payload))
+        self._root = self._Node.union(self._root, self._Node.build(nodes))
+
+    def add(self, key):
+        raise TypeError('use item assignment to add keys to a map')
+
+    def __getitem__(self, key):
+        node = self._Node.find(self._root, key)
+        if node is None:
+            raise KeyError(key)
+        return node.payload
+
+    def __setitem__(self, key, payload):
+        left, center, right = self._Node.split(self._root, key)
+        if center is None:
+            center = self._new_node(key, payload)
+        else:
+            center.payload = payload
+        self._root = self._Node.merge(left, center, right)
+
+    def __delitem__(self, key):
+        try:
+            self.remove(key)
+        except ValueError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        node = self._Node.find(self._root, key)
+        return default if node is None else node.payload
+
+    def setdefault(self, key, default=None):
+        left, center, right = self._Node.split(self._root, key)
+        if center is None:
+            center = self._new_node(key, default)
+        self._root = self._Node.merge(left, center, right)
+        return center.payload
+
+    def pop(self, key, default=__marker):
+        left, center, right = self._Node.split(self._root, key)
+        self._root = self._Node.merge(left, right)
+        if center is not None:
+            return center.payload
+        elif default is self.__marker:
+            raise KeyError(key)
+        return default
+
+    def floor_key(self, key):
+        '''Return the greatest key which is less than or equal to the passed one.'''
+        node, found = self._root, None
+        while node is not None:
+            if key < node.value:
+                node = node.left
+            else:
+                found, node = node, node.right
+        if found is None:
+            raise KeyError('no such key')
+        return found.value
+
+    def ceiling_key(self, key):
+        '''Return the least key which is greater than or equal to the passed one.'''
+        node, found = self._root, None
+        while node is not None:
+            if node.value < key:
+                node = node.right
+            else:
+                found, node = node, node.left
+        if found is None:
+            raise KeyError('no such key')
+        return found.value
+
+    def peekitem(self, index=-1):
+        if self._root is None:
+            raise IndexError('index out of range')
+        node = self._root.get_kth_node(index)
+        return node.value, node.payload
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        return (node.payload for node in self._walk(self._stack_to_kth(0)))
+
+    def items(self):
+        return ((node.value, node.payload) for node in self._walk(self._stack_to_kth(0)))
+
+    def __repr__(self):
+        return 'CartesianMap({0})'.format(list(self.items()))
+
+
+class PersistentCartesianTree(CartesianTree):
+    '''Build an ordered collection of unique elements, same as CartesianTree,
+    whose nodes are never modified once they are a part of a tree: split and
+    merge copy the O(log n) nodes they touch (path copying) instead of
+    changing them. Therefore snapshot() takes O(1) time and memory, and
+    old versions stay valid and may be read from other threads without
+    locks while this tree is modified.
+
+    >>> pt = PersistentCartesianTree([1, 2, 3, 5])
+    >>> old = pt.snapshot()
+    >>> pt.add(4)
+    >>> pt.remove(1)
+    >>> pt, old
+    ([2, 3, 4, 5], [1, 2, 3, 5])
+    >>> big = PersistentCartesianTree(range(100))
+    >>> versions = [big.snapshot()]
+    >>> big.add(100)
+    >>> distinct, total = PersistentCartesianTree.sharing(big, *versions)
+    >>> total, distinct < total
+    (201, True)
+    >>> other = old.snapshot()
+    >>> other.union(PersistentCartesianTree([0, 9]))
+    >>> other, old
+    ([0, 1, 2, 3, 5, 9], [1, 2, 3, 5])
+    '''
+
+    class _Node(CartesianTree._Node):
+
+        '''Store a single value. The node is copied instead of being changed.'''
+
+        __slots__ = ()
+
+        def _copy(self):
+            node = object.__new__(type(self))
+            node.value = self.value
+            node.left = self.left
+            node.right = self.right
+            node.priority = self.priority
+            node.size = self.size
+            return node
+
+        _writable = _copy
+
+        @classmethod
+        def split(cls, node, value):
+            '''Return a triple of subtrees (left, center, right), see
+            CartesianTree._Node.split. The passed tree stays intact.
+            '''
+            if node is None:
+                return None, None, None
+            node = node._copy()
+            if node.value < value:
+                left, center, right = cls.split(node.right, value)
+                node.right = left
+                node._recalc()
+                return node, center, right
+            elif node.value == value:
+                left, center, right = node.left, node, node.right
+                node.left = node.right = None
+                node._recalc()
+                return left, center, right
+            else:
+                left, center, right = cls.split(node.left, value)
+                node.left = right
+                node._recalc()
+                return left, center, node
+
+        @classmethod
+        def merge(cls, *subtrees):
+            '''Return a tree, see CartesianTree._Node.merge.
+            The passed trees stay intact.
+            '''
+            assert len(subtrees) > 0
+            if len(subtrees) == 1:
+                return subtrees[0]
+            elif len(subtrees) > 2:
+                return cls.merge(cls.merge(*subtrees[:2]), *subtrees[2:])
+
+            left, right = subtrees
+            if left is None:
+                return right
+            elif right is None:
+                return left
+            elif left.priority > right.priority:
+                left = left._copy()
+                left.right = cls.merge(left.right, right)
+                left._recalc()
+                return left
+            else:
+                right = right._copy()
+                right.left = cls.merge(left, right.left)
+                right._recalc()
+                return right
+
+    def snapshot(self):
+        '''Return a copy of the tree in O(1) time. The copy shares all
+        the nodes with this tree; either of them may be modified later.
+        '''
+        tree = self._empty()
+        tree._root = self._root
+        return tree
+
+    @staticmethod
+    def sharing(*versions):
+        '''Return a pair (distinct, total): the number of distinct nodes
+        in the given versions, and the number of nodes they would take
+        without sharing.
+        '''
+        seen = set()
+        stack = [tree._root for tree in versions if tree._root is not None]
+        while stack:
+            node = stack.pop()
+            if id(node) not in seen:
+                seen.add(id(node))
+                stack.extend(child for child in (node.left, node.right) if child is not None)
+        return len(seen), sum(len(tree) for tree in versions)
+
+
+class ArrayCartesianTree:
+    '''Build an ordered collection of unique elements with the same interface
+    as CartesianTree. Nodes are kept in parallel columns of the 'array' module
+    (keys, left, right, priority, size) instead of one Python object per node,
+    and split and merge are non-recursive, so a skewed tree can't hit
+    the recursion limit.
+
+    Keys are stored in array.array(typecode); pass typecode=None to store
+    arbitrary totally ordered objects in a plain list instead.
+    Priorities are 32-bit to keep the columns compact; they are drawn from
+    a generator of the tree, seeded with the given seed.
+    Node 0 is a sentinel which stands for an empty subtree. Removed nodes are
+    chained into a free list through the 'left' column and reused.
+
+    >>> ct = ArrayCartesianTree([5, 2])
+    >>> ct
+    [2, 5]
+    >>> ct.add(3)
+    >>> ct
+    [2, 3, 5]
+    >>> 3 in ct
+    True
+    >>> 4 in ct
+    False
+    >>> ct.remove(3)
+    >>> len(ct)
+    2
+    >>> ct.add(7)
+    >>> ct
+    [2, 5, 7]
+    >>> ct[-1]
+    7
+    >>> ct[3]
+    Traceback (most recent call last):
+    ...
+    IndexError: index out of range
+    >>> ct.next(4)
+    5
+    >>> ct.next(5)
+    7
+    >>> ct.prev(4)
+    2
+    >>> ct.prev(2)
+    Traceback (most recent call last):
+    ...
+    ValueError: no such element
+    >>> ct.remove(3)
+    Traceback (most recent call last):
+    ...
+    ValueError: no such element
+    >>> ct.add(4)
+    >>> ct
+    [2, 4, 5, 7]
+    >>> ct.bisect_left(5), ct.bisect_right(5), ct.rank(6)
+    (2, 3, 3)
+    >>> ct.add(4.5)
+    Traceback (most recent call last):
+    ...
+    TypeError: 'float' object cannot be interpreted as an integer
+    >>> ct
+    [2, 4, 5, 7]
+    >>> ArrayCartesianTree(['b', 'a', 'b'], typecode=None)
+    ['a', 'b']
+    >>> ArrayCartesianTree.from_sorted(range(5))
+    [0, 1, 2, 3, 4]
+    '''
+
+    import array
+    import random
+
+    def __init__(self, values, typecode='q', seed=None):
+        self.__random = self.random.Random(seed)
+        if typecode is None:
+            self.__keys = [None]
+        else:
+            self.__keys = self.array.array(typecode, [0])
+        self.__left = self.array.array('i', [0])
+        self.__right = self.array.array('i', [0])
+        self.__priority = self.array.array('I', [0])
+        self.__size = self.array.array('i', [0])
+        self.__free = 0
+        self.__root = self.__build(_unique(sorted(values)))
+
+    @classmethod
+    def from_sorted(cls, values, typecode='q', seed=None):
+        '''Build a tree in O(n) time. The values should be strictly increasing,
+        which is not checked.
+        '''
+        tree = cls((), typecode, seed)
+        tree.__root = tree.__build(values)
+        return tree
+
+    def __build(self, values):
+        '''Return a tree of the given strictly increasing values, see
+        CartesianTree._Node.build.
+        '''
+        left, right, priority, size = self.__left, self.__right, self.__priority, self.__size
+        stack = []
+        for value in values:
+            node = self.__new_node(value)
+            last = 0
+            while stack and priority[stack[-1]] <= priority[node]:
+                last = stack.pop()
+                size[last] = size[left[last]] + 1 + size[right[last]]
+            left[node] = last
+            if stack:
+                right[stack[-1]] = node
+            stack.append(node)
+        for node in reversed(stack):
+            size[node] = size[left[node]] + 1 + size[right[node]]
+        return stack[0] if stack else 0
+
+    def __new_node(self, value):
+        priority = self.__random.getrandbits(32)
+        node = self.__free
+        if node:
+            self.__keys[node] = value
+            self.__free = self.__left[node]
+            self.__left[node] = 0
+            self.__priority[node] = priority
+            self.__size[node] = 1
+        else:
+            node = len(self.__size)
+            self.__keys.append(value)
+            self.__left.append(0)
+            self.__right.append(0)
+            self.__priority.append(priority)
+            self.__size.append(1)
+        return node
+
+    def __free_node(self, node):
+        if isinstance(self.__keys, list):
+            self.__keys[node] = None
+        self.__left[node] = self.__free
+        self.__right[node] = 0
+        self.__size[node] = 0
+        self.__free = node
+
+    def __split(self, node, value):
+        '''Return a pair of subtrees (left, right). All the values in the left
+        subtree are less than the passed value. All the values in the right
+        subtree are greater or equal than the passed value.
+        The sentinel serves as a temporary hook for both of the results.
+        '''
+        keys, left, right, size = self.__keys, self.__left, self.__right, self.__size
+        left_hook = right_hook = 0
+        path = []
+        while node:
+            path.append(node)
+            if keys[node] < value:
+                right[left_hook] = node
+                left_hook = node
+                node = right[node]
+            else:
+                left[right_hook] = node
+                right_hook = node
+                node = left[node]
+        right[left_hook] = 0
+        left[right_hook] = 0
+        left_root, right_root = right[0], left[0]
+        right[0] = left[0] = 0
+        for node in reversed(path):
+            size[node] = size[left[node]] + 1 + size[right[node]]
+        return left_root, right_root
+
+    def __merge(self, left_node, right_node):
+        '''Return a tree. All the values in the left subtree should be less
+        than the minimal value in the right subtree.
+        '''
+        left, right, priority, size = self.__left, self.__right, self.__priority, self.__size
+        hook, hook_is_right = 0, True
+        path = []
+        while left_node and right_node:
+            if priority[left_node] > priority[right_node]:
+                node, left_node = left_node, right[left_node]
+                node_is_right = True
+            else:
+                node, right_node = right_node, left[right_node]
+                node_is_right = False
+            if hook_is_right:
+                right[hook] = node
+            else:
+                left[hook] = node
+            hook, hook_is_right = node, node_is_right
+            path.append(node)
+        if hook_is_right:
+            right[hook] = left_node or right_node
+        else:
+            left[hook] = left_node or right_node
+        root = right[0]
+        right[0] = 0
+        for node in reversed(path):
+            size[node] = size[left[node]] + 1 + size[right[node]]
+        return root
+
+    def __find(self, value):
+        keys, left, right = self.__keys, self.__left, self.__right
+        node = self.__root
+        while node:
+            key = keys[node]
+            if value < key:
+                node = left[node]
+            elif key < value:
+                node = right[node]
+            else:
+                return node
+        return 0
+
+    def add(self, value):
+        # the key is stored before the split, so a value that does not fit
+        # the typed array raises with the tree intact
+        node = self.__new_node(value)
+        left, right = self.__split(self.__root, value)
+        first = right
+        while self.__left[first]:
+            first = self.__left[first]
+        if first and not value < self.__keys[first]:
+            self.__free_node(node)
+            self.__root = self.__merge(left, right)
+        else:
+            self.__root = self.__merge(self.__merge(left, node), right)
+
+    def __contains__(self, value):
+        return self.__find(value) != 0
+
+    def remove(self, value):
+        keys, left, right, size = self.__keys, self.__left, self.__right, self.__size
+        parent, node = 0, self.__root
+        path = []
+        while node:
+            key = keys[node]
+            if value < key:
+                parent, node = node, left[node]
+            elif key < value:
+                parent, node = node, right[node]
+            else:
+                break
+            path.append(parent)
+        if not node:
+            raise ValueError('no such element')
+        subtree = self.__merge(left[node], right[node])
+        if not parent:
+            self.__root = subtree
+        elif left[parent] == node:
+            left[parent] = subtree
+        else:
+            right[parent] = subtree
+        for parent in path:
+            size[parent] -= 1
+        self.__free_node(node)
+
+    def discard(self, value):
         try:
-            if self.__Node.sizeof(left) == 0:
-                raise ValueError('no such element')
-            retval = left.get_kth_node(-1).value
-        finally:
-            self.__root = self.__Node.merge(left, center, right)
-        return retval
-    
+            self.remove(value)
+        except ValueError:
+            pass
+
+    def __len__(self):
+        return self.__size[self.__root]
+
+    def __getitem__(self, index):
+        if not isinstance(index, int):
+            raise TypeError('cartesian tree indices must be integers')
+        left, right, size = self.__left, self.__right, self.__size
+        node = self.__root
+        if index < 0:
+            index += size[node]
+        if not (0 <= index < size[node]):
+            raise IndexError('index out of range')
+        while True:
+            left_size = size[left[node]]
+            if left_size == index:
+                return self.__keys[node]
+            elif left_size > index:
+                node = left[node]
+            else:
+                index -= left_size + 1
+                node = right[node]
+
+    def next(self, value):
+        keys, left, right = self.__keys, self.__left, self.__right
+        node, found = self.__root, 0
+        while node:
+            if value < keys[node]:
+                found, node = node, left[node]
+            else:
+                node = right[node]
+        if not found:
+            raise ValueError('no such element')
+        return keys[found]
+
+    def prev(self, value):
+        keys, left, right = self.__keys, self.__left, self.__right
+        node, found = self.__root, 0
+        while node:
+            if keys[node] < value:
+                found, node = node, right[node]
+            else:
+                node = left[node]
+        if not found:
+            raise ValueError('no such element')
+        return keys[found]
+
+    def bisect_left(self, value):
+        keys, left, right, size = self.__keys, self.__left, self.__right, self.__size
+        node, rank = self.__root, 0
+        while node:
+            if keys[node] < value:
+                rank += size[left[node]] + 1
+                node = right[node]
+            else:
+                node = left[node]
+        return rank
+
+    rank = bisect_left
+
+    def bisect_right(self, value):
+        keys, left, right, size = self.__keys, self.__left, self.__right, self.__size
+        node, rank = self.__root, 0
+        while node:
+            if value < keys[node]:
+                node = left[node]
+            else:
+                rank += size[left[node]] + 1
+                node = right[node]
+        return rank
+
     def __repr__(self):
         return repr(list(self))
 
 
+def benchmark(n=200000):
+    '''Compare CartesianTree and ArrayCartesianTree on n random keys:
+    memory per element (measured with tracemalloc) and operations per second.
+    '''
+    import random
+    import time
+    import tracemalloc
+
+    rng = random.Random(1)
+    values = rng.sample(range(10 * n), n)
+    probes = [rng.randrange(10 * n) for i in range(n)]
+
+    for cls in CartesianTree, ArrayCartesianTree:
+        tracemalloc.start()
+        ct = cls(values)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del ct
+
+        start = time.perf_counter()
+        ct = cls(values)
+        add_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for value in probes:
+            value in ct
+        contains_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for value in values[:n // 2]:
+            ct.remove(value)
+        remove_time = time.perf_counter() - start
+
+        print('{0}: {1:.1f} bytes/element, add {2:.0f} ops/s, '
+              'contains {3:.0f} ops/s, remove {4:.0f} ops/s'.format(
+                  cls.__name__, memory / n, n / add_time,
+                  n / contains_time, n // 2 / remove_time))
+
+
+def benchmark_reads(n=1000000, queries=200000):
+    '''Compare read throughput of the top-down search path with the former
+    split-and-merge path on a tree of n elements.
+    '''
+    import random
+    import time
+
+    rng = random.Random(1)
+    ct = CartesianTree.from_sorted(range(0, 2 * n, 2))
+    probes = [rng.randrange(2 * n) for i in range(queries)]
+    node_type = ct._Node
+
+    def split_merge_contains(value):
+        left, center, right = node_type.split(ct._root, value)
+        ct._root = node_type.merge(left, center, right)
+        return center is not None
+
+    for name, query in [('split/merge contains', split_merge_contains),
+                        ('top-down contains', ct.__contains__),
+                        ('top-down rank', ct.rank)]:
+        start = time.perf_counter()
+        for value in probes:
+            query(value)
+        print('{0}: {1:.0f} ops/s'.format(name, queries / (time.perf_counter() - start)))
+
+
+def benchmark_build(n=1000000):
+    '''Compare bulk construction of a tree of n elements with adding them
+    one by one.
+    '''
+    import random
+    import time
+
+    values = list(range(n))
+    shuffled = values[:]
+    random.Random(1).shuffle(shuffled)
+
+    def add_one_by_one(cls):
+        tree = cls(())
+        for value in shuffled:
+            tree.add(value)
+        return tree
+
+    for cls in CartesianTree, ArrayCartesianTree:
+        for name, build in [('add one by one', add_one_by_one),
+                            ('unsorted input', lambda cls: cls(shuffled)),
+                            ('from_sorted', lambda cls: cls.from_sorted(values))]:
+            start = time.perf_counter()
+            build(cls)
+            print('{0}, {1}: {2:.2f} s'.format(cls.__name__, name,
+                                               time.perf_counter() - start))
+
+
+def benchmark_set_operations(n=1000000, m=10000):
+    '''Compare union and difference of trees of n and m elements with
+    adding or removing the m elements one by one.
+    '''
+    import random
+    import time
+
+    rng = random.Random(1)
+    big = range(0, 2 * n, 2)
+    small = sorted(rng.sample(range(2 * n), m))
+
+    for name, batch, loop in [('union', CartesianTree.union, CartesianTree.add),
+                              ('difference', CartesianTree.difference, CartesianTree.discard)]:
+        tree, other = CartesianTree.from_sorted(big), CartesianTree.from_sorted(small)
+        start = time.perf_counter()
+        batch(tree, other)
+        batch_time = time.perf_counter() - start
+
+        tree = CartesianTree.from_sorted(big)
+        start = time.perf_counter()
+        for value in small:
+            loop(tree, value)
+        loop_time = time.perf_counter() - start
+
+        print('{0}: batch {1:.3f} s, one by one {2:.3f} s'.format(name, batch_time, loop_time))
+
+
+def benchmark_map(n=200000):
+    '''Compare CartesianMap with a dict plus a sorted list of keys kept
+    with bisect: insertion, lookup, floor queries and deletion of n keys.
+    '''
+    import bisect
+    import random
+    import time
+
+    class DictWithSortedKeys:
+
+        def __init__(self):
+            self.dict = {}
+            self.keys = []
+
+        def __setitem__(self, key, payload):
+            if key not in self.dict:
+                bisect.insort(self.keys, key)
+            self.dict[key] = payload
+
+        def __getitem__(self, key):
+            return self.dict[key]
+
+        def __delitem__(self, key):
+            del self.dict[key]
+            del self.keys[bisect.bisect_left(self.keys, key)]
+
+        def floor_key(self, key):
+            return self.keys[bisect.bisect_right(self.keys, key) - 1]
+
+    rng = random.Random(1)
+    keys = rng.sample(range(10 * n), n)
+
+    for mapping in DictWithSortedKeys(), CartesianMap():
+        timings = []
+        start = time.perf_counter()
+        for key in keys:
+            mapping[key] = key
+        timings.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        for key in keys:
+            mapping[key]
+        timings.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        for key in keys:
+            mapping.floor_key(key + 1)
+        timings.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        for key in keys:
+            del mapping[key]
+        timings.append(time.perf_counter() - start)
+        print('{0}: set {1:.0f} ops/s, get {2:.0f} ops/s, floor_key {3:.0f} ops/s, '
+              'del {4:.0f} ops/s'.format(type(mapping).__name__, *[n / t for t in timings]))
+
+
+def benchmark_snapshots(n=100000, versions=100, updates=100):
+    '''Take a snapshot of a persistent tree of n elements after every batch
+    of updates and report how many nodes the versions share.
+    '''
+    import random
+    import time
+
+    rng = random.Random(1)
+    tree = PersistentCartesianTree.from_sorted(range(0, 2 * n, 2))
+    snapshots = []
+    start = time.perf_counter()
+    for i in range(versions):
+        for j in range(updates):
+            tree.add(rng.randrange(2 * n))
+            tree.discard(rng.randrange(2 * n))
+        snapshots.append(tree.snapshot())
+    elapsed = time.perf_counter() - start
+
+    distinct, total = PersistentCartesianTree.sharing(*snapshots)
+    print('{0} versions: {1:.0f} updates/s, {2} distinct nodes for {3} elements, '
+          'shared-node ratio {4:.3f}'.format(versions, 2 * versions * updates / elapsed,
+                                             distinct, total, 1 - distinct / total))
+
+
 if __name__ == '__main__':
     import doctest
-    doctest.testmod()
\ No newline at end of file
+    doctest.testmod()
+    # benchmark()
+    # benchmark_reads()
+    # benchmark_build()
+    # benchmark_set_operations()
+    # benchmark_map()
+    # benchmark_snapshots()
\ No newline at end of file
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+class ImplicitCartesianTree:
+    '''Build a sequence of elements (duplicates allowed) with O(log n) average
+    time for insertion and deletion at any position, cutting and pasting
+    of ranges, reversal of a range, and lazy range addition and assignment.
+
+    Nodes are ordered by position (the implicit key is the size of everything
+    to the left), so this is a list, not a sorted collection.
+
+    If operation is given, every subtree maintains the aggregate of its
+    elements, so aggregate(i, j) runs in O(log n) time. Operation should be
+    associative; it should also be commutative if reverse() is used.
+    range_add needs to know how an aggregate changes when delta is added
+    to each of size elements: pass shift(aggregate, delta, size). For min,
+    max and addition it is known already.
+    Priorities are 64-bit and come from a generator of the tree, seeded with
+    the given seed (unpredictably by default).
+    Ranges are half-open: [i, j).
+
+    >>> it = ImplicitCartesianTree([1, 2, 3, 4, 5], int.__add__)
+    >>> it
+    ImplicitCartesianTree([1, 2, 3, 4, 5], int.__add__)
+    >>> it.insert(2, 10)
+    >>> it
+    ImplicitCartesianTree([1, 2, 10, 3, 4, 5], int.__add__)
+    >>> it.aggregate(1, 4)
+    15
+    >>> it.reverse(0, 4)
+    >>> list(it)
+    [3, 10, 2, 1, 4, 5]
+    >>> it.range_add(1, 3, 100)
+    >>> it[1:3], it.aggregate(0, 6)
+    ([110, 102], 225)
+    >>> it.range_assign(3, 6, 7)
+    >>> list(it), it.aggregate(2, 5)
+    ([3, 110, 102, 7, 7, 7], 116)
+    >>> it.delete(0)
+    >>> it[0], it[-1], len(it)
+    (110, 7, 5)
+    >>> middle = it.cut(1, 3)
+    >>> middle, it
+    (ImplicitCartesianTree([102, 7], int.__add__), ImplicitCartesianTree([110, 7, 7], int.__add__))
+    >>> it.paste(0, middle)
+    >>> it, len(middle)
+    (ImplicitCartesianTree([102, 7, 110, 7, 7], int.__add__), 0)
+    >>> it[5]
+    Traceback (most recent call last):
+    ...
+    IndexError: index out of range
+    >>> letters = ImplicitCartesianTree('abc')
+    >>> letters[1] = 'x'
+    >>> letters.append('d')
+    >>> letters.reverse(0, 4)
+    >>> letters
+    ImplicitCartesianTree(['d', 'c', 'x', 'a'])
+    >>> letters.aggregate(0, 1)
+    Traceback (most recent call last):
+    ...
+    TypeError: no operation to aggregate with
+    '''
+
+    import operator
+    import random
+
+    class _Node:
+
+        '''Store a single element and the pending updates of its subtree.
+        The value and the aggregate of a node are always up to date; the pending
+        updates should still be applied to its children.
+        '''
+
+        __slots__ = ('value', 'aggregate', 'left', 'right', 'priority', 'size',
+                     'reversed', 'pending_add', 'pending_assign')
+
+        def __init__(self, value, priority):
+            self.value = value
+            self.aggregate = value
+            self.left = None
+            self.right = None
+            self.priority = priority
+            self.size = 1
+            self.reversed = False
+            self.pending_add = None
+            self.pending_assign = None
+
+    def __init__(self, iterable, operation=None, shift=None, seed=None):
+        self.operation = operation
+        if shift is None:
+            if operation in (min, max):
+                shift = lambda aggregate, delta, size: aggregate + delta
+            elif operation in (self.operator.add, int.__add__, float.__add__):
+                shift = lambda aggregate, delta, size: aggregate + delta * size
+        self.shift = shift
+        self.__random = self.random.Random(seed)
+        self.__root = self.__build(iterable)
+
+    def __new_node(self, value):
+        return self._Node(value, self.__random.getrandbits(64))
+
+    @staticmethod
+    def __sizeof(node):
+        return node.size if node is not None else 0
+
+    def __recalc(self, node):
+        left, right = node.left, node.right
+        node.size = self.__sizeof(left) + 1 + self.__sizeof(right)
+        if self.operation is not None:
+            aggregate = node.value
+            if left is not None:
+                aggregate = self.operation(left.aggregate, aggregate)
+            if right is not None:
+                aggregate = self.operation(aggregate, right.aggregate)
+            node.aggregate = aggregate
+
+    def __power(self, value, count):
+        '''Return the aggregate of count copies of value.'''
+        result = None
+        while count:
+            if count & 1:
+                result = value if result is None else self.operation(result, value)
+            count >>= 1
+            if count:
+                value = self.operation(value, value)
+        return result
+
+    def __apply_reverse(self, node):
+        node.left, node.right = node.right, node.left
+        node.reversed = not node.reversed
+
+    def __apply_add(self, node, delta):
+        node.value += delta
+        if self.operation is not None:
+            node.aggregate = self.shift(node.aggregate, delta, node.size)
+        if node.pending_assign is not None:
+            node.pending_assign += delta
+        elif node.pending_add is not None:
+            node.pending_add += delta
+        else:
+            node.pending_add = delta
+
+    def __apply_assign(self, node, value):
+        node.value = value
+        if self.operation is not None:
+            node.aggregate = self.__power(value, node.size)
+        node.pending_assign = value
+        node.pending_add = None
+
+    def __push(self, node):
+        '''Apply the pending updates of a node to its children.'''
+        children = [child for child in (node.left, node.right) if child is not None]
+        if node.reversed:
+            for child in children:
+                self.__apply_reverse(child)
+            node.reversed = False
+        if node.pending_assign is not None:
+            for child in children:
+                self.__apply_assign(child, node.pending_assign)
+            node.pending_assign = None
+        if node.pending_add is not None:
+            for child in children:
+                self.__apply_add(child, node.pending_add)
+            node.pending_add = None
+
+    def __split(self, node, k):
+        '''Return a pair of subtrees (left, right): the left one contains
+        the first k elements, the right one contains the rest.
+        '''
+        if node is None:
+            return None, None
+        self.__push(node)
+        left_size = self.__sizeof(node.left)
+        if k <= left_size:
+            left, node.left = self.__split(node.left, k)
+            self.__recalc(node)
+            return left, node
+        else:
+            node.right, right = self.__split(node.right, k - left_size - 1)
+            self.__recalc(node)
+            return node, right
+
+    def __merge(self, left, right):
+        if left is None:
+            return right
+        elif right is None:
+            return left
+        elif left.priority > right.priority:
+            self.__push(left)
+            left.right = self.__merge(left.right, right)
+            self.__recalc(left)
+            return left
+        else:
+            self.__push(right)
+            right.left = self.__merge(left, right.left)
+            self.__recalc(right)
+            return right
+
+    def __build(self, values):
+        '''Return a tree of the given values in O(n) time, see CartesianTree._Node.build.'''
+        stack = []
+        for value in values:
+            node = self.__new_node(value)
+            last = None
+            while stack and stack[-1].priority <= node.priority:
+                last = stack.pop()
+                self.__recalc(last)
+            node.left = last
+            if stack:
+                stack[-1].right = node
+            stack.append(node)
+        for node in reversed(stack):
+            self.__recalc(node)
+        return stack[0] if stack else None
+
+    def __check_index(self, index, length):
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError('index out of range')
+        return index
+
+    def __check_range(self, i, j):
+        if not 0 <= i <= j <= len(self):
+            raise IndexError('range out of bounds')
+
+    def __kth_node(self, k):
+        node = self.__root
+        while True:
+            self.__push(node)
+            left_size = self.__sizeof(node.left)
+            if left_size == k:
+                return node
+            elif left_size > k:
+                node = node.left
+            else:
+                k -= left_size + 1
+                node = node.right
+
+    def __three_way_split(self, i, j):
+        left, right = self.__split(self.__root, j)
+        left, middle = self.__split(left, i)
+        return left, middle, right
+
+    def __len__(self):
+        return self.__sizeof(self.__root)
+
+    def __iter__(self):
+        stack = []
+        node = self.__root
+        while stack or node is not None:
+            while node is not None:
+                self.__push(node)
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.value
+            node = node.right
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        return self.__kth_node(self.__check_index(index, len(self))).value
+
+    def __setitem__(self, index, value):
+        index = self.__check_index(index, len(self))
+        self.range_assign(index, index + 1, value)
+
+    def insert(self, index, value):
+        '''Insert value before the given position, the same way list.insert does.'''
+        length = len(self)
+        if index < 0:
+            index = max(index + length, 0)
+        left, right = self.__split(self.__root, min(index, length))
+        self.__root = self.__merge(self.__merge(left, self.__new_node(value)), right)
+
+    def append(self, value):
+        self.__root = self.__merge(self.__root, self.__new_node(value))
+
+    def delete(self, index):
+        index = self.__check_index(index, len(self))
+        left, middle, right = self.__three_way_split(index, index + 1)
+        self.__root = self.__merge(left, right)
+
+    def cut(self, i, j):
+        '''Remove the elements [i, j) and return them as a new tree.'''
+        self.__check_range(i, j)
+        left, middle, right = self.__three_way_split(i, j)
+        self.__root = self.__merge(left, right)
+        # the seed comes from this tree's generator, so seeded trees stay deterministic
+        tree = type(self)((), self.operation, self.shift, self.__random.getrandbits(64))
+        tree.__root = middle
+        return tree
+
+    def paste(self, index, other):
+        '''Insert all the elements of other tree before the given position.
+        The nodes are moved, not copied: other tree becomes empty.
+        '''
+        self.__check_range(index, index)
+        if other is self:
+            raise ValueError('cannot paste a tree into itself')
+        left, right = self.__split(self.__root, index)
+        middle, other.__root = other.__root, None
+        self.__root = self.__merge(self.__merge(left, middle), right)
+
+    def reverse(self, i, j):
+        self.__check_range(i, j)
+        left, middle, right = self.__three_way_split(i, j)
+        if middle is not None:
+            self.__apply_reverse(middle)
+        self.__root = self.__merge(self.__merge(left, middle), right)
+
+    def range_add(self, i, j, delta):
+        '''Add delta to each of the elements [i, j).'''
+        self.__check_range(i, j)
+        if self.operation is not None and self.shift is None:
+            raise TypeError('range addition needs a shift function for this operation')
+        left, middle, right = self.__three_way_split(i, j)
+        if middle is not None:
+            self.__apply_add(middle, delta)
+        self.__root = self.__merge(self.__merge(left, middle), right)
+
+    def range_assign(self, i, j, value):
+        '''Set each of the elements [i, j) to value.'''
+        self.__check_range(i, j)
+        left, middle, right = self.__three_way_split(i, j)
+        if middle is not None:
+            self.__apply_assign(middle, value)
+        self.__root = self.__merge(self.__merge(left, middle), right)
+
+    def aggregate(self, i, j):
+        '''Return the aggregate of the elements [i, j), which should not be empty.'''
+        if self.operation is None:
+            raise TypeError('no operation to aggregate with')
+        assert i < j
+        self.__check_range(i, j)
+        left, middle, right = self.__three_way_split(i, j)
+        result = middle.aggregate
+        self.__root = self.__merge(self.__merge(left, middle), right)
+        return result
+
+    def __repr__(self):
+        if self.operation is None:
+            return 'ImplicitCartesianTree({0})'.format(list(self))
+        if '__objclass__' in dir(self.operation):
+            methodname = self.operation.__objclass__.__name__ + '.' + self.operation.__name__
+        else:
+            methodname = self.operation.__name__
+        return 'ImplicitCartesianTree({0}, {1})'.format(list(self), methodname)
+
+
+def benchmark(n=1000000, operations=10000):
+    '''Compare insertions and deletions in the middle of a sequence of n
+    elements with list.insert and del.
+    '''
+    import random
+    import time
+
+    rng = random.Random(1)
+    positions = [rng.randrange(n // 4, 3 * n // 4) for i in range(operations)]
+
+    for name, container, insert, delete in [
+            ('list', list(range(n)), list.insert, list.__delitem__),
+            ('ImplicitCartesianTree', ImplicitCartesianTree(range(n)),
+             ImplicitCartesianTree.insert, ImplicitCartesianTree.delete)]:
+        start = time.perf_counter()
+        for position in positions:
+            insert(container, position, position)
+        for position in positions:
+            delete(container, position)
+        print('{0}: {1:.0f} ops/s'.format(name, 2 * operations / (time.perf_counter() - start)))
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+    # benchmark()
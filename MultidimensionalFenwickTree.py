@@ -13,7 +13,7 @@ class MultidimensionalFenwickSumTree:
     Time complexity of operations:
       assume n is maximal index among all dimensions,
              d is number of dimensions.
-      * construction: O(n^d log^d n)
+      * construction: O(d n^d)
       * update: O(log^d n)
       * range sum query: O(2^d log^d n)
 
@@ -29,9 +29,29 @@ class MultidimensionalFenwickSumTree:
     MultidimensionalFenwickSumTree([[0, 1, 2, 3], [4, 5, 6, 7], [8, 9, 8, 1]])
     >>> mfst[1:3][0:3].sum()
     40
+    >>> mfst.add_many([(0, 0), (2, 3), (0, 0)], [5, 1, 5])
+    >>> mfst.sum_many([[(0, 1), (0, 1)], [(1, 3), (0, 3)], [(0, 3), (4, 4)]])
+    [10, 40, 0]
+    >>> mfst.sum_many([[(0, 1), (0, 5)]])
+    Traceback (most recent call last):
+    ...
+    IndexError: index out of range
+    >>> mfst[1:3][2:4] += 10
+    >>> mfst
+    MultidimensionalFenwickSumTree([[10, 1, 2, 3], [4, 5, 16, 17], [8, 9, 18, 12]])
+    >>> mfst[0:2] += 1
+    Traceback (most recent call last):
+    ...
+    IndexError: not enough levels of indices
     '''
 
-    import copy
+    import itertools
+
+    # dim -> (update, prefix_sum, slice_sum), see _kernels
+    KERNELS = {}
+    # Python allows at most 20 statically nested blocks in a function
+    MAX_UNROLLED_DIM = 16
+    __update = __prefix = __slice_sum = None
 
     class SliceView:
         '''Provide access to elements and subtables of a Fenwick tree.
@@ -44,47 +64,39 @@ class MultidimensionalFenwickSumTree:
             self.mfst = mfst
             self.indices = indices
 
-        def __fenwick_rec_update(self, indices, difference, level, subtable):
-            k = indices[level].start
-            while k < self.mfst.length[level]:
-                if level + 1 == self.mfst.dim:
-                    subtable[k] += difference
-                else:
-                    self.__fenwick_rec_update(indices, difference, level + 1, subtable[k])
-                k = k | (k + 1)
-
         def __getitem__(self, index, value=None):
+            mfst = self.mfst
             level = len(self.indices)
-            assert level < self.mfst.dim, 'too many levels of indices'
+            assert level < mfst.dim, 'too many levels of indices'
+            length = mfst.length[level]
 
             if isinstance(index, int):
                 if index < 0:
-                    index += self.mfst.length[level]
+                    index += length
                 index = slice(index, index + 1)
 
-            if (not 0 <= index.start < self.mfst.length[level] or 
-                not index.start < index.stop <= self.mfst.length[level]):
+            if (not 0 <= index.start < length or
+                not index.start < index.stop <= length):
                 raise IndexError('index out of range')
 
             indices = self.indices + (index,)
 
-            if (level + 1 == self.mfst.dim and
-                all([i.start + 1 == i.stop for i in indices])):
-                tmp = self.mfst.table
-                for i in indices[:-1]:
-                    tmp = tmp[i.start]
+            if (level + 1 == mfst.dim and
+                all(i.start + 1 == i.stop for i in indices)):
+                point = tuple(i.start for i in indices)
                 if value is None:
-                    return tmp[indices[-1].start]
+                    return mfst._get(point)
                 else:
-                    difference = value - tmp[indices[-1].start]
-                    tmp[indices[-1].start] = value
-
-                    self.__fenwick_rec_update(indices, difference, 0, self.mfst.sum)
+                    mfst._set(point, value)
             else:
                 if value is None:
-                    return type(self)(self.mfst, indices)
+                    return type(self)(mfst, indices)
+                elif (isinstance(value, type(self)) and value.mfst is mfst and
+                      value.indices == indices):
+                    # box += k has already updated the box in place
+                    return
                 else:
-                    if level + 1 == self.mfst.dim:
+                    if level + 1 == mfst.dim:
                         raise IndexError('cannot assign to a slice')
                     else:
                         raise IndexError('not enough levels of indices')
@@ -92,80 +104,278 @@ class MultidimensionalFenwickSumTree:
         def __setitem__(self, index, value):
             self.__getitem__(index, value)
 
-        def __rec_prefix_sum(self, res, indices, level, subtable):
-            k = indices[level] - 1
-            while k >= 0:
-                if level + 1 == self.mfst.dim:
-                    res[0] += subtable[k]
-                else:
-                    self.__rec_prefix_sum(res, indices, level + 1, subtable[k])
-                k = (k & (k + 1)) - 1
+        def __iadd__(self, value):
+            if len(self.indices) != self.mfst.dim:
+                raise IndexError('not enough levels of indices')
+            self.mfst._range_add([(i.start, i.stop) for i in self.indices], value)
+            return self
 
-        def prefix_sum(self, indices):
-            res = [self.mfst.scalar_type()]
-            self.__rec_prefix_sum(res, indices, 0, self.mfst.sum)
-            return res[0]
+        def __isub__(self, value):
+            return self.__iadd__(-value)
 
-        def __rec_sum(self, res, indices, parity, level):
-            if level == self.mfst.dim:
-                res[0] += parity * self.prefix_sum(indices)
-            else:
-                indices.append(self.indices[level].start)
-                self.__rec_sum(res, indices, -parity, level + 1)
-                indices.pop()
-                indices.append(self.indices[level].stop)
-                self.__rec_sum(res, indices, parity, level + 1)
-                indices.pop()
+        def prefix_sum(self, indices):
+            return self.mfst._prefix_sum(indices)
 
         def sum(self):
-            res = [self.mfst.scalar_type()]
-            self.__rec_sum(res, [], 1, 0)
-            return res[0]
+            return self.mfst._slice_sum(self.indices)
 
-    def __init__(self, table):
+    def __init__(self, table, copy=True):
         '''Build a table. Parameter 'table' should consist of nested lists. 
         Everything which is not a list inside 'tables' is treated as a scalar 
-        value.
+        value. With copy=False the tree takes ownership of the lists instead of
+        copying them: the caller should not use them afterwards.
+        '''
+        self.length, self.scalar_type = self._shape(table)
+        self.dim = len(self.length)
+
+        self.table = self._copy_table(table, 0) if copy else table
+        self.sum = self._copy_table(self.table, 0)
+        self.__build(self.sum, 0)
+        if self.dim <= self.MAX_UNROLLED_DIM:
+            self.__update, self.__prefix, self.__slice_sum = self._kernels(self.dim)
+        else:
+            self.__update = self.__prefix = self.__slice_sum = None
+
+    @classmethod
+    def _kernels(cls, dim):
+        '''Return the functions update(tree, lengths, point, difference),
+        prefix_sum(tree, zero, indices) and slice_sum(tree, zero, slices)
+        with the loops over the dimensions unrolled. They are generated once
+        for every dim and walk the Fenwick tree without recursion or
+        allocations. slice_sum walks the chains of start - 1 and stop - 1
+        together until they meet, so their common tail is never read.
         '''
-        table = self.copy.deepcopy(table)
-        self.length = []
+        if dim not in cls.KERNELS:
+            names = ''.join('{{0}}{0}, '.format(level) for level in range(dim))
+            source = ['def update(tree, lengths, point, difference):',
+                      '    ' + names.format('n') + '= lengths',
+                      '    ' + names.format('p') + '= point',
+                      '    t0 = tree']
+            for level in range(dim):
+                pad = '    ' * (level + 1)
+                source += [pad + 'k{0} = p{0}'.format(level),
+                           pad + 'while k{0} < n{0}:'.format(level)]
+                if level + 1 == dim:
+                    source.append(pad + '    t{0}[k{0}] += difference'.format(level))
+                else:
+                    source.append(pad + '    t{1} = t{0}[k{0}]'.format(level, level + 1))
+            for level in reversed(range(dim)):
+                source.append('    ' * (level + 2) + 'k{0} |= k{0} + 1'.format(level))
+
+            source += ['def prefix_sum(tree, zero, indices):',
+                       '    ' + names.format('i') + '= indices',
+                       '    res = zero',
+                       '    t0 = tree']
+            for level in range(dim):
+                pad = '    ' * (level + 1)
+                source += [pad + 'k{0} = i{0} - 1'.format(level),
+                           pad + 'while k{0} >= 0:'.format(level)]
+                if level + 1 == dim:
+                    source.append(pad + '    res += t{0}[k{0}]'.format(level))
+                else:
+                    source.append(pad + '    t{1} = t{0}[k{0}]'.format(level, level + 1))
+            for level in reversed(range(dim)):
+                source.append('    ' * (level + 2) + 'k{0} = (k{0} & (k{0} + 1)) - 1'.format(level))
+            source.append('    return res')
+
+            source += ['def slice_sum(tree, zero, slices):',
+                       '    ' + names.format('s') + '= slices',
+                       '    t0 = tree',
+                       '    r0 = zero']
+            for level in range(dim):
+                pad = '    ' * (level + 1)
+                source += [pad + 'i{0} = s{0}.stop - 1'.format(level),
+                           pad + 'j{0} = s{0}.start - 1'.format(level),
+                           pad + 'while i{0} != j{0}:'.format(level)]
+                for branch, k, sign in ('if i{0} > j{0}:', 'i', True), ('else:', 'j', False):
+                    source.append(pad + '    ' + branch.format(level))
+                    if level + 1 == dim:
+                        source.append(pad + '        r{0} {1}= t{0}[{2}{0}]'.format(
+                            level, '+' if sign else '-', k))
+                    else:
+                        source += [pad + '        t{1} = t{0}[{2}{0}]'.format(level, level + 1, k),
+                                   pad + '        positive{0} = {1}'.format(level, sign)]
+                    source.append(pad + '        {1}{0} = ({1}{0} & ({1}{0} + 1)) - 1'.format(level, k))
+                if level + 1 < dim:
+                    source.append(pad + '    r{0} = zero'.format(level + 1))
+            for level in reversed(range(dim - 1)):
+                pad = '    ' * (level + 2)
+                source += [pad + 'if positive{0}:'.format(level),
+                           pad + '    r{0} += r{1}'.format(level, level + 1),
+                           pad + 'else:',
+                           pad + '    r{0} -= r{1}'.format(level, level + 1)]
+            source.append('    return r0')
+
+            namespace = {}
+            exec(compile('\n'.join(source), '<{0} kernels, dim={1}>'.format(cls.__name__, dim), 'exec'),
+                 namespace)
+            cls.KERNELS[dim] = namespace['update'], namespace['prefix_sum'], namespace['slice_sum']
+        return cls.KERNELS[dim]
+
+    @staticmethod
+    def _shape(table):
+        '''Return the lengths of the nested lists on every level and the type
+        of the scalars, checking that the table is rectangular.
+        '''
+        length = []
         mainstream_subtable = table
         stack_for_length_check = [mainstream_subtable]
 
         while isinstance(mainstream_subtable, list):
-            self.length.append(len(mainstream_subtable))
+            length.append(len(mainstream_subtable))
             for subtable in stack_for_length_check:
-                if len(subtable) != self.length[-1]:
+                if len(subtable) != length[-1]:
                     raise ValueError('length mismatch on level {0}: '
                         'the subtable {1} should be of length {2} '
-                        'as the subtable {3} is'.format(level, subtable,
-                            self.length[-1], mainstream_subtable))
+                        'as the subtable {3} is'.format(len(length) - 1, subtable,
+                            length[-1], mainstream_subtable))
             mainstream_subtable = mainstream_subtable[0]
             stack_for_length_check = [j for i in stack_for_length_check 
                                         for j in i]
 
-        self.scalar_type = type(mainstream_subtable)
-        self.dim = len(self.length)
+        assert len(length) > 0
+        assert 0 not in length
+        return length, type(mainstream_subtable)
 
-        assert self.dim > 0
-        assert 0 not in self.length
+    def _copy_table(self, subtable, level):
+        if level + 1 == self.dim:
+            return list(subtable)
+        return [self._copy_table(i, level + 1) for i in subtable]
 
-        self.sum = [self.scalar_type() for i in range(self.length[-1])]
-        for i in self.length[-2::-1]:
-            self.sum = [self.copy.deepcopy(self.sum) for j in range(i)]
+    def __add_table(self, destination, source, level):
+        if level + 1 == self.dim:
+            for i, value in enumerate(source):
+                destination[i] += value
+        else:
+            for i, j in zip(destination, source):
+                self.__add_table(i, j, level + 1)
 
-        self.table = self.copy.deepcopy(self.sum)
+    def __build(self, subtable, level):
+        '''Turn a copy of the table into the Fenwick tree in O(d n^d) time:
+        in each dimension in turn, every cell k is added into its Fenwick
+        parent k | (k + 1). The cells are processed in increasing order, so
+        a cell is complete by the time it is added into its parent.
+        '''
+        if level == self.dim:
+            return
+        length = self.length[level]
+        for k in range(length):
+            parent = k | (k + 1)
+            if parent < length:
+                if level + 1 == self.dim:
+                    subtable[parent] += subtable[k]
+                else:
+                    self.__add_table(subtable[parent], subtable[k], level + 1)
+        if level + 1 < self.dim:
+            for i in subtable:
+                self.__build(i, level + 1)
+
+    def _get(self, point):
+        tmp = self.table
+        for i in point:
+            tmp = tmp[i]
+        return tmp
+
+    def _set(self, point, value):
+        self._add(point, value - self._get(point))
+
+    def _add(self, point, difference):
+        tmp = self.table
+        for i in point[:-1]:
+            tmp = tmp[i]
+        tmp[point[-1]] += difference
+        if self.__update is not None:
+            self.__update(self.sum, self.length, point, difference)
+        else:
+            self.__fenwick_rec_update(point, difference, 0, self.sum)
 
-        def recursive_construction(level, slice_indices, subtable):
-            if level < self.dim:
-                for i in range(self.length[level]):
-                    slice_indices.append(slice(i, i + 1))
-                    recursive_construction(level + 1, slice_indices, subtable[i])
-                    slice_indices.pop()
+    def __fenwick_rec_update(self, point, difference, level, subtable):
+        k = point[level]
+        while k < self.length[level]:
+            if level + 1 == self.dim:
+                subtable[k] += difference
             else:
-                self.SliceView(self, tuple(slice_indices[:-1]))[slice_indices[-1]] = subtable
+                self.__fenwick_rec_update(point, difference, level + 1, subtable[k])
+            k = k | (k + 1)
 
-        recursive_construction(0, [], table)
+    def __rec_prefix_sum(self, res, indices, level, subtable):
+        k = indices[level] - 1
+        while k >= 0:
+            if level + 1 == self.dim:
+                res[0] += subtable[k]
+            else:
+                self.__rec_prefix_sum(res, indices, level + 1, subtable[k])
+            k = (k & (k + 1)) - 1
+
+    def _prefix_sum(self, indices):
+        '''Return the sum over the box [0, indices[0]) x [0, indices[1]) x ...'''
+        if self.__prefix is not None:
+            return self.__prefix(self.sum, self.scalar_type(), indices)
+        res = [self.scalar_type()]
+        self.__rec_prefix_sum(res, indices, 0, self.sum)
+        return res[0]
+
+    def _slice_sum(self, indices):
+        '''Return the sum over the box indices[0] x indices[1] x ...
+        of slices, the hot path of SliceView.sum.
+        '''
+        if self.__slice_sum is not None:
+            return self.__slice_sum(self.sum, self.scalar_type(), indices)
+        return self._box_sum([(i.start, i.stop) for i in indices])
+
+    def _box_sum(self, box):
+        '''Return the sum over the box [box[0][0], box[0][1]) x ...
+        by inclusion-exclusion over its 2^d corners.
+        '''
+        if self.__slice_sum is not None:
+            return self.__slice_sum(self.sum, self.scalar_type(), [slice(*i) for i in box])
+        res = self.scalar_type()
+        for corner in range(1 << self.dim):
+            indices = []
+            parity = 1
+            for level, (start, stop) in enumerate(box):
+                if corner >> level & 1:
+                    indices.append(stop)
+                else:
+                    indices.append(start)
+                    parity = -parity
+            if all(indices):
+                res += parity * self._prefix_sum(indices)
+        return res
+
+    def _range_add(self, box, difference):
+        '''Add difference to every cell of the box, one cell at a time:
+        O(volume log^d n), see RangeUpdateMultidimensionalFenwickSumTree.
+        '''
+        for point in self.itertools.product(*[range(start, stop) for start, stop in box]):
+            self._add(point, difference)
+
+    def _check_box(self, box):
+        if len(box) != self.dim:
+            raise IndexError('a box should have {0} dimensions'.format(self.dim))
+        for (start, stop), length in zip(box, self.length):
+            if not 0 <= start <= stop <= length:
+                raise IndexError('index out of range')
+
+    def add_many(self, points, deltas):
+        '''Add deltas[i] to the cell points[i] for every i, the same as
+        mfst[x][y][z] += delta, but without building views.
+        '''
+        for point, delta in zip(points, deltas):
+            point = tuple(point)
+            self._check_box([(i, i + 1) for i in point])
+            self._add(point, delta)
+
+    def sum_many(self, boxes):
+        '''Return the list of sums over the boxes. Every box is a sequence of
+        (start, stop) pairs, one per dimension, like the slices in
+        mfst[start:stop][start:stop].sum(); empty boxes are allowed.
+        '''
+        result = []
+        for box in boxes:
+            self._check_box(box)
+            result.append(self._box_sum(box))
+        return result
 
     def __repr__(self):
         return 'MultidimensionalFenwickSumTree({0})'.format(repr(self.table))
@@ -178,6 +388,1220 @@ class MultidimensionalFenwickSumTree:
 
 
 
+class MultidimensionalFenwickTree(MultidimensionalFenwickSumTree):
+    '''Build the same table as MultidimensionalFenwickSumTree, but with
+    an arbitrary commutative operation in place of +. Items should not be
+    None.
+
+    If inverse is given, (operation, inverse) should be an abelian group:
+    xor, addition modulo m, addition of vectors. Box queries work as usual,
+    by inclusion-exclusion, and sum() returns the aggregate of the box.
+    Without an inverse, operation should be a commutative monoid, such as
+    min or max. Only prefix boxes [0:i][0:j] can be queried, and a cell can
+    only be replaced by a value v with operation(old, v) == v.
+    The aggregate of an empty box is identity.
+    add_many combines each value into its cell with operation. box += k
+    adds k to every cell of the box and is only allowed when operation is
+    addition; for any other operation it raises TypeError.
+    MultidimensionalFenwickSumTree remains the fast path for + on int and
+    float.
+
+    >>> xft = MultidimensionalFenwickTree([[1, 2, 3], [4, 5, 6]], int.__xor__, inverse=lambda x: x)
+    >>> xft
+    MultidimensionalFenwickTree([[1, 2, 3], [4, 5, 6]], int.__xor__)
+    >>> xft[0:2][1:3].sum(), 2 ^ 3 ^ 5 ^ 6
+    (2, 2)
+    >>> xft[1][1] ^= 7
+    >>> xft[1][1], xft[1:2][0:3].sum()
+    (2, 0)
+    >>> mft = MultidimensionalFenwickTree([5, 6, 2], lambda x, y: (x + y) % 7, lambda x: -x % 7, 0)
+    >>> mft[1:3].sum(), mft.sum_many([[(0, 3)], [(2, 2)]])
+    (1, [6, 0])
+    >>> vft = MultidimensionalFenwickTree([(1, 0), (0, 1), (2, 2)],
+    ...                                   lambda u, v: (u[0] + v[0], u[1] + v[1]),
+    ...                                   lambda u: (-u[0], -u[1]))
+    >>> vft[1:3].sum()
+    (2, 3)
+    >>> vft.add_many([(0,), (2,)], [(1, 1), (-2, 0)])
+    >>> vft
+    MultidimensionalFenwickTree([(2, 1), (0, 1), (0, 2)], <lambda>)
+    >>> pmax = MultidimensionalFenwickTree([[3, 1], [4, 1], [5, 9]], max)
+    >>> pmax[0:2][0:2].sum()
+    4
+    >>> pmax[1][1] = 8
+    >>> pmax[0:2][0:2].sum(), pmax[0:3][0:1].sum()
+    (8, 5)
+    >>> pmax[1][1] = 2
+    Traceback (most recent call last):
+    ...
+    ValueError: cannot replace 8 by 2 without an inverse
+    >>> pmax[1:3][0:2].sum()
+    Traceback (most recent call last):
+    ...
+    ValueError: only prefix boxes can be queried without an inverse
+    >>> pmax[0:2][0:2] += 1
+    Traceback (most recent call last):
+    ...
+    TypeError: box += k needs addition as the operation, use add_many to combine values with max
+    '''
+
+    import operator
+
+    def __init__(self, table, operation, inverse=None, identity=None, copy=True):
+        self.length, self.scalar_type = self._shape(table)
+        self.dim = len(self.length)
+        self.operation = operation
+        self.inverse = inverse
+        self.identity = identity
+
+        self.table = self._copy_table(table, 0) if copy else table
+        self.sum = self._copy_table(self.table, 0)
+        self.__build(self.sum, 0)
+
+    def __combine_table(self, destination, source, level):
+        if level + 1 == self.dim:
+            for i, value in enumerate(source):
+                destination[i] = self.operation(destination[i], value)
+        else:
+            for i, j in zip(destination, source):
+                self.__combine_table(i, j, level + 1)
+
+    def __build(self, subtable, level):
+        '''See MultidimensionalFenwickSumTree.__build.'''
+        if level == self.dim:
+            return
+        length = self.length[level]
+        for k in range(length):
+            parent = k | (k + 1)
+            if parent < length:
+                if level + 1 == self.dim:
+                    subtable[parent] = self.operation(subtable[parent], subtable[k])
+                else:
+                    self.__combine_table(subtable[parent], subtable[k], level + 1)
+        if level + 1 < self.dim:
+            for i in subtable:
+                self.__build(i, level + 1)
+
+    def _set(self, point, value):
+        old = self._get(point)
+        if self.inverse is not None:
+            self._add(point, self.operation(value, self.inverse(old)))
+        elif self.operation(old, value) == value:
+            self._add(point, value)
+        else:
+            raise ValueError('cannot replace {0} by {1} without an inverse'.format(old, value))
+
+    def _add(self, point, value):
+        '''Combine value into the cell at point.'''
+        tmp = self.table
+        for i in point[:-1]:
+            tmp = tmp[i]
+        tmp[point[-1]] = self.operation(tmp[point[-1]], value)
+        self.__rec_update(point, value, 0, self.sum)
+
+    def _range_add(self, box, difference):
+        if self.operation not in (self.operator.add, int.__add__, float.__add__):
+            raise TypeError('box += k needs addition as the operation, '
+                            'use add_many to combine values with {0}'.format(self.operation.__name__))
+        super()._range_add(box, difference)
+
+    def __rec_update(self, point, value, level, subtable):
+        k = point[level]
+        while k < self.length[level]:
+            if level + 1 == self.dim:
+                subtable[k] = self.operation(subtable[k], value)
+            else:
+                self.__rec_update(point, value, level + 1, subtable[k])
+            k = k | (k + 1)
+
+    def __rec_prefix(self, res, indices, level, subtable):
+        k = indices[level] - 1
+        while k >= 0:
+            if level + 1 == self.dim:
+                res[0] = subtable[k] if res[0] is None else self.operation(res[0], subtable[k])
+            else:
+                self.__rec_prefix(res, indices, level + 1, subtable[k])
+            k = (k & (k + 1)) - 1
+
+    def __prefix(self, indices):
+        '''Return the aggregate of the box [0, indices[0]) x ..., None if empty.'''
+        res = [None]
+        if all(indices):
+            self.__rec_prefix(res, indices, 0, self.sum)
+        return res[0]
+
+    def _prefix_sum(self, indices):
+        res = self.__prefix(indices)
+        return self.identity if res is None else res
+
+    def _box_sum(self, box):
+        if self.inverse is None:
+            if any(start for start, stop in box):
+                raise ValueError('only prefix boxes can be queried without an inverse')
+            return self._prefix_sum([stop for start, stop in box])
+        res = None
+        for corner in range(1 << self.dim):
+            indices = []
+            positive = True
+            for level, (start, stop) in enumerate(box):
+                if corner >> level & 1:
+                    indices.append(stop)
+                else:
+                    indices.append(start)
+                    positive = not positive
+            prefix = self.__prefix(indices)
+            if prefix is not None:
+                if not positive:
+                    prefix = self.inverse(prefix)
+                res = prefix if res is None else self.operation(res, prefix)
+        return self.identity if res is None else res
+
+    def __repr__(self):
+        if '__objclass__' in dir(self.operation):
+            methodname = self.operation.__objclass__.__name__ + '.' + self.operation.__name__
+        else:
+            methodname = self.operation.__name__
+        return 'MultidimensionalFenwickTree({0}, {1})'.format(repr(self.table), methodname)
+
+
+class DenseMultidimensionalFenwickSumTree(MultidimensionalFenwickSumTree):
+    '''Build the same table as MultidimensionalFenwickSumTree, but keep
+    'table' and 'sum' as flat contiguous arrays in row-major order: NumPy
+    arrays if NumPy is installed, array.array otherwise. A cell (i, j, k)
+    lives at offset i * strides[0] + j * strides[1] + k * strides[2].
+    Scalars should be int or float; ints are stored as 64-bit integers.
+
+    >>> dfst = DenseMultidimensionalFenwickSumTree([[0, 1, 2, 3], [4, 5, 6, 7], [8, 9, 0, 1]])
+    >>> dfst
+    DenseMultidimensionalFenwickSumTree([[0, 1, 2, 3], [4, 5, 6, 7], [8, 9, 0, 1]])
+    >>> dfst[0:2][1:3].sum()
+    14
+    >>> dfst[2][2] = 8
+    >>> dfst[2][2], dfst[1:3][0:3].sum()
+    (8, 40)
+    >>> DenseMultidimensionalFenwickSumTree([0.5, 1.5])[0:2].sum()
+    2.0
+    >>> DenseMultidimensionalFenwickSumTree([[1, 2.5], [3, 4]])
+    DenseMultidimensionalFenwickSumTree([[1.0, 2.5], [3.0, 4.0]])
+    >>> dfst[0][0] = 3.5
+    Traceback (most recent call last):
+    ...
+    TypeError: 'float' object cannot be interpreted as an integer
+    >>> dfst, dfst[0:2][0:2].sum()
+    (DenseMultidimensionalFenwickSumTree([[0, 1, 2, 3], [4, 5, 6, 7], [8, 9, 8, 1]]), 10)
+    >>> dfst.add_many([(0, 0), (2, 3), (0, 0)], [5, 1, 5])
+    >>> [int(i) for i in dfst.sum_many([[(0, 1), (0, 1)], [(1, 3), (0, 3)], [(0, 3), (4, 4)]])]
+    [10, 40, 0]
+    >>> DenseMultidimensionalFenwickSumTree([[1, 2], [3]])
+    Traceback (most recent call last):
+    ...
+    ValueError: length mismatch on level 1: the subtable [3] should be of length 2 as the subtable [1, 2] is
+
+    A tree can be saved to a file and memory-mapped back by any number of
+    readers and a single writer, whose updates are applied to the file in
+    place and seen by the readers at once:
+
+    >>> import os, tempfile
+    >>> directory = tempfile.TemporaryDirectory()
+    >>> path = os.path.join(directory.name, 'table.fenwick')
+    >>> dfst.save(path)
+    >>> reader = DenseMultidimensionalFenwickSumTree.load(path)
+    >>> writer = DenseMultidimensionalFenwickSumTree.load(path, writable=True)
+    >>> reader
+    DenseMultidimensionalFenwickSumTree([[10, 1, 2, 3], [4, 5, 6, 7], [8, 9, 8, 2]])
+    >>> writer[1][1] += 100
+    >>> writer.flush()
+    >>> reader[1:3][0:3].sum()
+    140
+    >>> reader[0][0] = 0
+    Traceback (most recent call last):
+    ...
+    TypeError: the table is mapped read-only
+    >>> del reader, writer
+    >>> directory.cleanup()
+    '''
+
+    import array
+    import mmap
+    import operator
+    import struct
+
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+
+    TYPECODES = {int: ('q', 'int64'), float: ('d', 'float64')}
+
+    # magic, typecode, dim; followed by dim lengths as 64-bit unsigned integers
+    HEADER = struct.Struct('=8scxxxI')
+    MAGIC = b'FENWICK1'
+
+    mapping = None
+    writable = True
+
+    def __init__(self, table, copy=True):
+        '''Build a table from nested lists or, if NumPy is installed, from
+        an array of any shape. The Fenwick tree is built in O(d n^d) time.
+        With copy=False a contiguous NumPy array of the right dtype becomes
+        the table itself instead of being copied.
+        '''
+        if self.numpy is not None and isinstance(table, self.numpy.ndarray):
+            self.length = list(table.shape)
+            assert len(self.length) > 0
+            assert 0 not in self.length
+            self.scalar_type = {'b': int, 'i': int, 'u': int, 'f': float}.get(table.dtype.kind)
+            flat = table.reshape(-1)
+        else:
+            self.length, self.scalar_type = self._shape(table)
+            flat = table
+            for level in range(len(self.length) - 1):
+                flat = [j for i in flat for j in i]
+            # the first scalar alone would truncate the floats after an int
+            types = set(map(type, flat))
+            if types == {int, float}:
+                self.scalar_type = float
+            elif len(types) > 1:
+                self.scalar_type = None
+        self.dim = len(self.length)
+        if self.scalar_type not in self.TYPECODES:
+            raise TypeError('dense storage supports int and float scalars only')
+        self.__set_strides()
+
+        typecode, dtype = self.TYPECODES[self.scalar_type]
+        if self.numpy is not None:
+            if copy:
+                self.table = self.numpy.array(flat, dtype=dtype)
+            else:
+                self.table = self.numpy.asarray(flat, dtype=dtype)
+            self.sum = self.table.copy()
+            self.__build_numpy(self.sum)
+        else:
+            self.table = self.array.array(typecode, flat)
+            self.sum = self.array.array(typecode, self.table)
+            self.__build_flat()
+
+    def __set_strides(self):
+        self.strides = [1] * self.dim
+        for i in range(self.dim - 2, -1, -1):
+            self.strides[i] = self.strides[i + 1] * self.length[i + 1]
+
+    def save(self, path):
+        '''Write the tree to a file: the header, then 'table' and 'sum' as
+        flat arrays in native byte order.
+        '''
+        typecode = self.TYPECODES[self.scalar_type][0]
+        with open(path, 'wb') as file:
+            file.write(self.HEADER.pack(self.MAGIC, typecode.encode(), self.dim))
+            file.write(self.struct.pack('={0}Q'.format(self.dim), *self.length))
+            file.write(self.table)
+            file.write(self.sum)
+
+    @classmethod
+    def load(cls, path, writable=False):
+        '''Map a file written by save into memory and return the tree
+        backed by it, without copying or rebuilding anything. The file can
+        be mapped by several processes at once. Only one of them should map
+        it writable: updates are applied to the file in place and are not
+        synchronized, so readers may see an update half applied. Call flush
+        to make sure the updates have reached the disk.
+        '''
+        with open(path, 'r+b' if writable else 'rb') as file:
+            mapping = cls.mmap.mmap(file.fileno(), 0,
+                                    access=cls.mmap.ACCESS_WRITE if writable else cls.mmap.ACCESS_READ)
+        magic, typecode, dim = cls.HEADER.unpack_from(mapping)
+        if magic != cls.MAGIC:
+            raise ValueError('{0} is not a saved Fenwick tree'.format(path))
+        typecode = typecode.decode()
+        ((scalar_type, (typecode, dtype)),) = [item for item in cls.TYPECODES.items()
+                                               if item[1][0] == typecode]
+
+        self = cls.__new__(cls)
+        self.length = list(cls.struct.unpack_from('={0}Q'.format(dim), mapping, cls.HEADER.size))
+        self.dim = dim
+        self.scalar_type = scalar_type
+        self.__set_strides()
+        self.mapping = mapping
+        self.writable = writable
+
+        start = cls.HEADER.size + 8 * dim
+        size = self.strides[0] * self.length[0] * cls.array.array(typecode).itemsize
+        if len(mapping) != start + 2 * size:
+            raise ValueError('{0} is truncated'.format(path))
+        if cls.numpy is not None:
+            cells = self.strides[0] * self.length[0]
+            self.table = cls.numpy.frombuffer(mapping, dtype, cells, start)
+            self.sum = cls.numpy.frombuffer(mapping, dtype, cells, start + size)
+        else:
+            view = memoryview(mapping)
+            self.table = view[start:start + size].cast(typecode)
+            self.sum = view[start + size:start + 2 * size].cast(typecode)
+        return self
+
+    def flush(self):
+        '''Write the updates of a writable mapped tree to the disk.'''
+        if self.mapping is not None:
+            self.mapping.flush()
+
+    def __build_numpy(self, flat):
+        '''Turn a flat table into its Fenwick tree in place.
+        See MultidimensionalFenwickSumTree.__build: each step adds a whole
+        hyperplane of cells into its parent hyperplane.
+        '''
+        view = flat.reshape(self.length)
+        for level, length in enumerate(self.length):
+            prefix = (slice(None),) * level
+            for k in range(length):
+                parent = k | (k + 1)
+                if parent < length:
+                    view[prefix + (parent,)] += view[prefix + (k,)]
+
+    def __build_flat(self):
+        '''See MultidimensionalFenwickSumTree.__build. Increasing offsets visit
+        the cells of every line of the level in increasing order.
+        '''
+        flat = self.sum
+        for level, length in enumerate(self.length):
+            stride = self.strides[level]
+            for offset in range(len(flat)):
+                k = offset // stride % length
+                parent = k | (k + 1)
+                if parent < length:
+                    flat[offset + (parent - k) * stride] += flat[offset]
+
+    def __offset(self, point):
+        return sum(i * stride for i, stride in zip(point, self.strides))
+
+    def _get(self, point):
+        return self.scalar_type(self.table[self.__offset(point)])
+
+    def __scalar(self, value):
+        '''Return value as the scalar type of the table, raising TypeError
+        instead of truncating a float into an int table.
+        '''
+        if self.scalar_type is int:
+            return self.operator.index(value)
+        return float(value)
+
+    def _add(self, point, difference):
+        if not self.writable:
+            raise TypeError('the table is mapped read-only')
+        # checked before either array is touched, so a failure leaves them consistent
+        difference = self.__scalar(difference)
+        self.table[self.__offset(point)] += difference
+
+        offsets = [0]
+        for k, length, stride in zip(point, self.length, self.strides):
+            steps = []
+            while k < length:
+                steps.append(k * stride)
+                k = k | (k + 1)
+            offsets = [offset + step for offset in offsets for step in steps]
+        # items of a memoryview are read and written as plain Python numbers,
+        # much faster than through a NumPy gather for a few hundred cells
+        cells = memoryview(self.sum)
+        for offset in offsets:
+            cells[offset] += difference
+
+    def _prefix_sum(self, indices):
+        offsets = [0]
+        for k, stride in zip(indices, self.strides):
+            steps = []
+            k -= 1
+            while k >= 0:
+                steps.append(k * stride)
+                k = (k & (k + 1)) - 1
+            offsets = [offset + step for offset in offsets for step in steps]
+        cells = memoryview(self.sum)
+        return self.scalar_type(sum(cells[offset] for offset in offsets))
+
+    def _box_sum(self, box):
+        '''Return the sum over the box with a single pass over one list of
+        offsets of all its 2^d corners. In every dimension the prefix chains
+        of stop and start are walked together and signed +1 and -1; they
+        stop where they meet, as the cells they share cancel out.
+        '''
+        terms = [(0, 1)]
+        for (start, stop), stride in zip(box, self.strides):
+            steps = []
+            k, j = stop - 1, start - 1
+            while k != j:
+                if k > j:
+                    steps.append((k * stride, 1))
+                    k = (k & (k + 1)) - 1
+                else:
+                    steps.append((j * stride, -1))
+                    j = (j & (j + 1)) - 1
+            terms = [(offset + step, sign * step_sign)
+                     for offset, sign in terms for step, step_sign in steps]
+        cells = memoryview(self.sum)
+        return self.scalar_type(sum(cells[offset] * sign for offset, sign in terms))
+
+    def __chains(self, indices, update):
+        '''Return the offsets of the Fenwick cells for a batch of points as
+        an array of shape (points, cells), together with a mask of the valid
+        ones. Update chains go up with k | (k + 1) from the point itself,
+        prefix chains go down with (k & (k + 1)) - 1 from the point minus one.
+        '''
+        numpy = self.numpy
+        offsets = numpy.zeros((len(indices), 1), dtype=numpy.int64)
+        valid = numpy.ones((len(indices), 1), dtype=bool)
+        for level, length in enumerate(self.length):
+            k = indices[:, level] if update else indices[:, level] - 1
+            steps = length.bit_length() + 1
+            chain = numpy.empty((len(indices), steps), dtype=numpy.int64)
+            chain_valid = numpy.empty((len(indices), steps), dtype=bool)
+            for step in range(steps):
+                chain_valid[:, step] = (k < length) if update else (k >= 0)
+                chain[:, step] = k * self.strides[level]
+                k = (k | (k + 1)) if update else (k & (k + 1)) - 1
+            offsets = (offsets[:, :, None] + chain[:, None, :]).reshape(len(indices), -1)
+            valid = (valid[:, :, None] & chain_valid[:, None, :]).reshape(len(indices), -1)
+        return offsets, valid
+
+    CHUNK = 4096
+
+    def __reads(self, count):
+        '''Return the bound on the Fenwick cells touched by count chains.'''
+        for length in self.length:
+            count *= length.bit_length()
+        return count
+
+    def add_many(self, points, deltas):
+        '''Add deltas[i] to the cell points[i] for every i. With NumPy
+        the whole batch is processed with vectorized operations. A batch that
+        would write more Fenwick cells than the table has is scattered into
+        a table of differences first, which is turned into a Fenwick tree in
+        O(d n^d) time and added to the tree as a whole.
+        '''
+        if self.numpy is None:
+            return super().add_many(points, deltas)
+        if not self.writable:
+            raise TypeError('the table is mapped read-only')
+        numpy = self.numpy
+        points = numpy.asarray(points, dtype=numpy.int64).reshape(-1, self.dim)
+        deltas = numpy.asarray(deltas)
+        if self.scalar_type is int and deltas.size and deltas.dtype.kind not in 'biu':
+            raise TypeError('cannot add {0} deltas to an int table'.format(deltas.dtype))
+        deltas = numpy.broadcast_to(deltas.astype(self.table.dtype), (len(points),))
+        if ((points < 0) | (points >= numpy.array(self.length))).any():
+            raise IndexError('index out of range')
+
+        offsets = points @ numpy.array(self.strides)
+        if self.__reads(len(points)) >= len(self.table):
+            difference = numpy.zeros_like(self.table)
+            numpy.add.at(difference, offsets, deltas)
+            self.table += difference
+            self.__build_numpy(difference)
+            self.sum += difference
+            return
+        numpy.add.at(self.table, offsets, deltas)
+        for i in range(0, len(points), self.CHUNK):
+            offsets, valid = self.__chains(points[i:i + self.CHUNK], update=True)
+            chunk_deltas = numpy.broadcast_to(deltas[i:i + self.CHUNK, None], offsets.shape)
+            numpy.add.at(self.sum, offsets[valid], chunk_deltas[valid])
+
+    def sum_many(self, boxes):
+        '''Return the sums over the boxes, see MultidimensionalFenwickSumTree.
+        With NumPy the result is an array, and every corner of all the boxes
+        is processed at once with vectorized gathers. A batch that would read
+        more Fenwick cells than the table has is answered from the prefix sums
+        of the whole table instead, computed with cumsum in O(cells) time.
+        '''
+        if self.numpy is None:
+            return super().sum_many(boxes)
+        numpy = self.numpy
+        boxes = numpy.asarray(boxes, dtype=numpy.int64).reshape(-1, self.dim, 2)
+        length = numpy.array(self.length)
+        if ((boxes[:, :, 0] < 0) | (boxes[:, :, 0] > boxes[:, :, 1]) |
+                (boxes[:, :, 1] > length)).any():
+            raise IndexError('index out of range')
+
+        result = numpy.zeros(len(boxes), dtype=self.sum.dtype)
+        if self.__reads(len(boxes) << self.dim) >= len(self.table):
+            prefix = numpy.zeros([size + 1 for size in self.length], dtype=self.sum.dtype)
+            prefix[(slice(1, None),) * self.dim] = self.table.reshape(self.length)
+            for level in range(self.dim):
+                numpy.cumsum(prefix, axis=level, out=prefix)
+            for corner in range(1 << self.dim):
+                bits = [corner >> level & 1 for level in range(self.dim)]
+                parity = -1 if (self.dim - sum(bits)) % 2 else 1
+                result += parity * prefix[tuple(boxes[:, level, bit] for level, bit in enumerate(bits))]
+            return result
+
+        for i in range(0, len(boxes), self.CHUNK):
+            chunk = boxes[i:i + self.CHUNK]
+            for corner in range(1 << self.dim):
+                bits = [corner >> level & 1 for level in range(self.dim)]
+                parity = -1 if (self.dim - sum(bits)) % 2 else 1
+                indices = chunk[:, numpy.arange(self.dim), bits]
+                offsets, valid = self.__chains(indices, update=False)
+                sums = numpy.where(valid, self.sum[numpy.where(valid, offsets, 0)], 0).sum(axis=1)
+                result[i:i + self.CHUNK] += parity * sums
+        return result
+
+    def __nested(self, flat):
+        flat = flat.tolist()
+        for i in range(self.dim - 1, 0, -1):
+            flat = [flat[j:j + self.length[i]] for j in range(0, len(flat), self.length[i])]
+        return flat
+
+    def __repr__(self):
+        return 'DenseMultidimensionalFenwickSumTree({0})'.format(repr(self.__nested(self.table)))
+
+
+
+class RangeUpdateMultidimensionalFenwickSumTree(MultidimensionalFenwickSumTree):
+    '''Build the same table as MultidimensionalFenwickSumTree, but make
+    adding a constant to a whole box as fast as a single update:
+
+        mfst[x1:x2][y1:y2][z1:z2] += k
+
+    Adding k to every cell x >= c (componentwise) changes the sum over the
+    box [0, p) by k * prod(p[i] - c[i]). Expanded over the subsets S of
+    dimensions, this is the sum of prod(p[i] for i not in S) times
+    k * prod(-c[i] for i in S), so 2^d auxiliary Fenwick trees, one per S,
+    are kept instead of the table. They are stored interleaved: every cell
+    of 'sum' is a list of 2^d coefficients, so one walk serves all of them.
+    A box update is 2^d such corner updates with alternating signs, and
+    a box sum is 2^d prefix sums, as usual.
+
+    Time complexity of operations:
+      * construction: O((d + 2^d) n^d)
+      * range update, update: O(2^d log^d n) cells of 2^d coefficients
+      * range sum query, item: O(2^d log^d n) cells of 2^d coefficients
+
+    >>> rfst = RangeUpdateMultidimensionalFenwickSumTree([[0, 1, 2, 3], [4, 5, 6, 7], [8, 9, 0, 1]])
+    >>> rfst
+    RangeUpdateMultidimensionalFenwickSumTree([[0, 1, 2, 3], [4, 5, 6, 7], [8, 9, 0, 1]])
+    >>> rfst[1:3][2:4] += 10
+    >>> rfst[0:2][1:3] -= 1
+    >>> rfst
+    RangeUpdateMultidimensionalFenwickSumTree([[0, 0, 1, 3], [4, 4, 15, 17], [8, 9, 10, 11]])
+    >>> rfst[1:3][1:4].sum(), rfst[2][3]
+    (66, 11)
+    >>> rfst[2][3] = 0
+    >>> rfst.sum_many([[(0, 3), (0, 4)], [(2, 3), (3, 4)]])
+    [71, 0]
+    '''
+
+    def __init__(self, table):
+        '''Build a table from nested lists. The table is not kept: cells
+        are read back as sums over boxes of a single cell.
+        '''
+        self.length, self.scalar_type = self._shape(table)
+        self.dim = len(self.length)
+        self.sum = self.__corner_table(table)
+        self.__build(self.sum, 0)
+
+    def __coefficients(self, corner, difference):
+        '''Return difference * prod(-corner[i] for i in S) for every subset S,
+        where S is a bit mask of dimensions.
+        '''
+        coefficients = [difference]
+        for i in corner:
+            coefficients += [-i * coefficient for coefficient in coefficients]
+        return coefficients
+
+    def __corner_table(self, table):
+        '''Return the coefficients of the corner updates that add up to table.
+        The difference of the table along every dimension in turn gives the
+        value k of the update at every corner c.
+        '''
+        flat = list(table)
+        for level in range(self.dim - 1):
+            flat = [j for i in flat for j in i]
+        stride = len(flat)
+        for length in self.length:
+            stride //= length
+            for offset in range(len(flat) - 1, -1, -1):
+                if offset // stride % length:
+                    flat[offset] -= flat[offset - stride]
+        flat = [self.__coefficients(corner, difference) for corner, difference in
+                zip(self.itertools.product(*[range(length) for length in self.length]), flat)]
+        for length in reversed(self.length[1:]):
+            flat = [flat[i:i + length] for i in range(0, len(flat), length)]
+        return flat
+
+    def __add_cells(self, destination, source, level):
+        if level == self.dim:
+            for i, coefficient in enumerate(source):
+                destination[i] += coefficient
+        else:
+            for i, j in zip(destination, source):
+                self.__add_cells(i, j, level + 1)
+
+    def __build(self, subtable, level):
+        '''See MultidimensionalFenwickSumTree.__build.'''
+        if level == self.dim:
+            return
+        length = self.length[level]
+        for k in range(length):
+            parent = k | (k + 1)
+            if parent < length:
+                self.__add_cells(subtable[parent], subtable[k], level + 1)
+        for i in subtable:
+            self.__build(i, level + 1)
+
+    def __rec_update(self, corner, coefficients, level, subtable):
+        k = corner[level]
+        while k < self.length[level]:
+            if level + 1 == self.dim:
+                cell = subtable[k]
+                for i, coefficient in enumerate(coefficients):
+                    cell[i] += coefficient
+            else:
+                self.__rec_update(corner, coefficients, level + 1, subtable[k])
+            k = k | (k + 1)
+
+    def __rec_prefix_sum(self, res, indices, level, subtable):
+        k = indices[level] - 1
+        while k >= 0:
+            if level + 1 == self.dim:
+                cell = subtable[k]
+                for i, coefficient in enumerate(cell):
+                    res[i] += coefficient
+            else:
+                self.__rec_prefix_sum(res, indices, level + 1, subtable[k])
+            k = (k & (k + 1)) - 1
+
+    def _prefix_sum(self, indices):
+        res = [self.scalar_type()] * (1 << self.dim)
+        self.__rec_prefix_sum(res, indices, 0, self.sum)
+        weights = [1]
+        for i in indices:
+            weights = [i * weight for weight in weights] + weights
+        return sum((weight * value for weight, value in zip(weights, res)), self.scalar_type())
+
+    def _range_add(self, box, difference):
+        if any(start == stop for start, stop in box):
+            return
+        for corner in range(1 << self.dim):
+            point = []
+            sign = 1
+            for level, (start, stop) in enumerate(box):
+                if corner >> level & 1:
+                    point.append(stop)
+                    sign = -sign
+                else:
+                    point.append(start)
+            if all(i < length for i, length in zip(point, self.length)):
+                self.__rec_update(point, self.__coefficients(point, sign * difference), 0, self.sum)
+
+    def _get(self, point):
+        return self._box_sum([(i, i + 1) for i in point])
+
+    def _add(self, point, difference):
+        self._range_add([(i, i + 1) for i in point], difference)
+
+    def __nested(self, point):
+        if len(point) == self.dim:
+            return self._get(point)
+        return [self.__nested(point + (i,)) for i in range(self.length[len(point)])]
+
+    def __repr__(self):
+        return 'RangeUpdateMultidimensionalFenwickSumTree({0})'.format(repr(self.__nested(())))
+
+
+class SparseMultidimensionalFenwickSumTree(MultidimensionalFenwickSumTree):
+    '''Build a table of the given lengths filled with zeros, except for
+    the given cells, without materializing it. The cells and the Fenwick
+    nodes that are not zero are kept in dicts keyed by the flat offset
+    i * strides[0] + j * strides[1] + ..., so memory is proportional to the
+    number of touched Fenwick nodes, O(m log^d n) after m updates,
+    rather than to the volume of the table.
+
+    Time complexity of operations:
+      * construction: O(m log^d n) for m cells
+      * update: O(log^d n)
+      * range sum query: O(2^d log^d n)
+
+    >>> sfst = SparseMultidimensionalFenwickSumTree([10 ** 6, 10 ** 6], {(3, 5): 2, (999999, 0): 7})
+    >>> sfst
+    SparseMultidimensionalFenwickSumTree([1000000, 1000000], {(3, 5): 2, (999999, 0): 7})
+    >>> sfst[0:1000][0:10 ** 6].sum(), sfst[3:10 ** 6][0:6].sum()
+    (2, 9)
+    >>> sfst[500000][500000] = 1
+    >>> sfst[3][5] -= 2
+    >>> sfst[0:10 ** 6][0:10 ** 6].sum(), sfst[3][5]
+    (8, 0)
+    >>> sfst
+    SparseMultidimensionalFenwickSumTree([1000000, 1000000], {(500000, 500000): 1, (999999, 0): 7})
+    '''
+
+    def __init__(self, length, cells=(), scalar_type=int):
+        '''Build a table of the given lengths. Cells is a mapping or an
+        iterable of pairs (point, value) of the cells which are not zero.
+        '''
+        self.length = list(length)
+        self.dim = len(self.length)
+        assert self.dim > 0
+        assert 0 not in self.length
+        self.scalar_type = scalar_type
+
+        self.strides = [1] * self.dim
+        for i in range(self.dim - 2, -1, -1):
+            self.strides[i] = self.strides[i + 1] * self.length[i + 1]
+
+        self.table = {}
+        self.sum = {}
+        for point, value in dict(cells).items():
+            point = tuple(point)
+            self._check_box([(i, i + 1) for i in point])
+            self._add(point, value)
+
+    def __offset(self, point):
+        return sum(i * stride for i, stride in zip(point, self.strides))
+
+    def _get(self, point):
+        return self.table.get(self.__offset(point), self.scalar_type())
+
+    def _add(self, point, difference):
+        offset = self.__offset(point)
+        value = self.table.get(offset, self.scalar_type()) + difference
+        if value:
+            self.table[offset] = value
+        else:
+            self.table.pop(offset, None)
+
+        offsets = [0]
+        for level, k in enumerate(point):
+            steps = []
+            while k < self.length[level]:
+                steps.append(k * self.strides[level])
+                k = k | (k + 1)
+            offsets = [offset + step for offset in offsets for step in steps]
+        for offset in offsets:
+            self.sum[offset] = self.sum.get(offset, self.scalar_type()) + difference
+
+    def _prefix_sum(self, indices):
+        offsets = [0]
+        for level, k in enumerate(indices):
+            steps = []
+            k -= 1
+            while k >= 0:
+                steps.append(k * self.strides[level])
+                k = (k & (k + 1)) - 1
+            offsets = [offset + step for offset in offsets for step in steps]
+        get = self.sum.get
+        zero = self.scalar_type()
+        return sum((get(offset, zero) for offset in offsets), zero)
+
+    def __point(self, offset):
+        point = []
+        for stride in self.strides:
+            index, offset = divmod(offset, stride)
+            point.append(index)
+        return tuple(point)
+
+    def __repr__(self):
+        cells = {self.__point(offset): value for offset, value in sorted(self.table.items())}
+        return 'SparseMultidimensionalFenwickSumTree({0}, {1})'.format(self.length, cells)
+
+
+class ConcurrentMultidimensionalFenwickSumTree(MultidimensionalFenwickSumTree):
+    '''Build the same table as MultidimensionalFenwickSumTree, safe to update
+    and query from many threads at once.
+
+    The top-level Fenwick indices (the first dimension of 'table' and
+    'sum') are split into stripes, k % stripes, each guarded by a lock.
+    Every operation first takes the locks of all the stripes it is going to
+    touch, in increasing order, and holds them until it is done. Two
+    operations touching different stripes run concurrently.
+
+    Consistency: every point update (add, item assignment, each item of
+    add_many), every box update (box += k) and every box sum (sum(), each
+    box of sum_many) is atomic and linearizable. A query sees each update
+    either completely or not at all, and the results match some sequential
+    order of the operations which respects their real-time order.
+    mfst[x][y][z] += k is a read followed by an assignment, not an atomic
+    increment: use add for that.
+
+    >>> cfst = ConcurrentMultidimensionalFenwickSumTree([[0, 1, 2, 3], [4, 5, 6, 7], [8, 9, 0, 1]])
+    >>> import threading
+    >>> threads = [threading.Thread(target=lambda: [cfst.add((1, 2), 1) for i in range(1000)])
+    ...            for j in range(4)]
+    >>> for thread in threads:
+    ...     thread.start()
+    >>> for thread in threads:
+    ...     thread.join()
+    >>> cfst[1][2], cfst[0:3][0:4].sum()
+    (4006, 4046)
+    '''
+
+    import threading
+
+    def __init__(self, table, copy=True, stripes=64):
+        super().__init__(table, copy)
+        self.locks = [self.threading.RLock() for i in range(min(stripes, self.length[0]))]
+
+    def __stripes(self, indices, update):
+        '''Return the sorted stripes of the top-level Fenwick indices on the
+        update chains of indices, or on their prefix chains.
+        '''
+        stripes = set()
+        count = len(self.locks)
+        length = self.length[0]
+        for k in indices:
+            if update:
+                while k < length:
+                    stripes.add(k % count)
+                    k = k | (k + 1)
+            else:
+                k -= 1
+                while k >= 0:
+                    stripes.add(k % count)
+                    k = (k & (k + 1)) - 1
+        return sorted(stripes)
+
+    def __locked(self, stripes, method, *args):
+        '''Call method with the locks of the stripes held.'''
+        locks = [self.locks[i] for i in stripes]
+        for lock in locks:
+            lock.acquire()
+        try:
+            return method(*args)
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def add(self, point, difference):
+        '''Atomically add difference to the cell at point.'''
+        point = tuple(point)
+        self._check_box([(i, i + 1) for i in point])
+        self._add(point, difference)
+
+    def _get(self, point):
+        return self.__locked([point[0] % len(self.locks)], super()._get, point)
+
+    def _set(self, point, value):
+        self.__locked(self.__stripes([point[0]], True), super()._set, point, value)
+
+    def _add(self, point, difference):
+        self.__locked(self.__stripes([point[0]], True), super()._add, point, difference)
+
+    def _range_add(self, box, difference):
+        start, stop = box[0]
+        self.__locked(self.__stripes(range(start, stop), True), super()._range_add, box, difference)
+
+    def _prefix_sum(self, indices):
+        return self.__locked(self.__stripes([indices[0]], False), super()._prefix_sum, indices)
+
+    def _slice_sum(self, indices):
+        stripes = self.__stripes([indices[0].start, indices[0].stop], False)
+        return self.__locked(stripes, super()._slice_sum, indices)
+
+    def _box_sum(self, box):
+        return self.__locked(self.__stripes(box[0], False), super()._box_sum, box)
+
+    def __repr__(self):
+        stripes = range(len(self.locks))
+        return self.__locked(stripes, lambda: 'ConcurrentMultidimensionalFenwickSumTree({0})'.format(
+            repr(self.table)))
+
+
+def _random_boxes(rng, n, count, dim=3):
+    '''Return count random boxes of an n x ... x n table as lists of
+    (start, stop) pairs, the format of sum_many. The first dimension is
+    at least 2 wide, so that box.sum() never meets a single cell.
+    '''
+    boxes = []
+    for j in range(count):
+        x1 = rng.randrange(n - 1)
+        boxes.append([(x1, rng.randrange(x1 + 2, n + 1))] +
+                     [tuple(sorted(rng.sample(range(n + 1), 2))) for i in range(dim - 1)])
+    return boxes
+
+
+def benchmark_storage(n=30, operations=20000):
+    '''Compare nested-list and dense storage on an n x n x n table of random
+    numbers: memory taken by the structure, updates and box sums per second.
+    '''
+    import gc
+    import random
+    import time
+    import tracemalloc
+
+    rng = random.Random(1)
+    table = [[[rng.randrange(10 ** 6) for i in range(n)] for j in range(n)] for k in range(n)]
+    points = [[rng.randrange(n) for i in range(3)] for j in range(operations)]
+    boxes = _random_boxes(rng, n, operations)
+
+    for cls in MultidimensionalFenwickSumTree, DenseMultidimensionalFenwickSumTree:
+        tracemalloc.start()
+        mfst = cls(table)
+        gc.collect()
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        for x, y, z in points:
+            mfst[x][y][z] += 1
+        update_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for (x1, x2), (y1, y2), (z1, z2) in boxes:
+            mfst[x1:x2][y1:y2][z1:z2].sum()
+        query_time = time.perf_counter() - start
+
+        print('{0}: {1:.1f} bytes/cell, {2:.0f} updates/s, {3:.0f} queries/s'.format(
+            cls.__name__, memory / n ** 3, operations / update_time, operations / query_time))
+
+
+def benchmark_build(n=40):
+    '''Compare the linear-time construction of an n x n x n table with
+    assigning its cells one by one, as the constructor used to do.
+    '''
+    import random
+    import time
+
+    rng = random.Random(1)
+    table = [[[rng.randrange(10 ** 6) for i in range(n)] for j in range(n)] for k in range(n)]
+
+    start = time.perf_counter()
+    mfst = MultidimensionalFenwickSumTree([[[0] * n for j in range(n)] for k in range(n)])
+    for x in range(n):
+        for y in range(n):
+            for z in range(n):
+                mfst[x][y][z] = table[x][y][z]
+    print('cell by cell: {0:.2f} s'.format(time.perf_counter() - start))
+
+    owned = [[list(i) for i in j] for j in table]
+    for name, build in [('nested lists', lambda: MultidimensionalFenwickSumTree(table)),
+                        ('nested lists, copy=False',
+                         lambda: MultidimensionalFenwickSumTree(owned, copy=False)),
+                        ('dense', lambda: DenseMultidimensionalFenwickSumTree(table))]:
+        start = time.perf_counter()
+        build()
+        print('{0}: {1:.2f} s'.format(name, time.perf_counter() - start))
+
+
+def benchmark_batches(n=50, operations=100000):
+    '''Compare item-by-item updates and box sums, as main() does them, with
+    add_many and sum_many on an n x n x n table.
+    '''
+    import random
+    import time
+
+    rng = random.Random(1)
+    points = [tuple(rng.randrange(n) for i in range(3)) for j in range(operations)]
+    deltas = [rng.randrange(-10 ** 6, 10 ** 6) for j in range(operations)]
+    boxes = _random_boxes(rng, n, operations)
+
+    mfst = MultidimensionalFenwickSumTree([[[0] * n for i in range(n)] for j in range(n)])
+    start = time.perf_counter()
+    for (x, y, z), k in zip(points, deltas):
+        mfst[x][y][z] += k
+    update_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for (x1, x2), (y1, y2), (z1, z2) in boxes:
+        mfst[x1:x2][y1:y2][z1:z2].sum()
+    query_time = time.perf_counter() - start
+    print('item by item: {0:.0f} updates/s, {1:.0f} queries/s'.format(
+        operations / update_time, operations / query_time))
+
+    for cls in MultidimensionalFenwickSumTree, DenseMultidimensionalFenwickSumTree:
+        mfst = cls([[[0] * n for i in range(n)] for j in range(n)])
+        start = time.perf_counter()
+        mfst.add_many(points, deltas)
+        update_time = time.perf_counter() - start
+        start = time.perf_counter()
+        mfst.sum_many(boxes)
+        query_time = time.perf_counter() - start
+        print('{0} batches: {1:.0f} updates/s, {2:.0f} queries/s'.format(
+            cls.__name__, operations / update_time, operations / query_time))
+
+
+def benchmark_range_updates(n=30, operations=1000):
+    '''Compare adding a constant to random boxes of an n x n x n table,
+    cell by cell and with RangeUpdateMultidimensionalFenwickSumTree,
+    followed by as many box sums.
+    '''
+    import random
+    import time
+
+    rng = random.Random(1)
+    boxes = _random_boxes(rng, n, operations)
+
+    for cls in MultidimensionalFenwickSumTree, RangeUpdateMultidimensionalFenwickSumTree:
+        mfst = cls([[[0] * n for i in range(n)] for j in range(n)])
+        start = time.perf_counter()
+        for (x1, x2), (y1, y2), (z1, z2) in boxes:
+            mfst[x1:x2][y1:y2][z1:z2] += 1
+        update_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for (x1, x2), (y1, y2), (z1, z2) in boxes:
+            mfst[x1:x2][y1:y2][z1:z2].sum()
+        query_time = time.perf_counter() - start
+
+        print('{0}: {1:.0f} range updates/s, {2:.0f} queries/s'.format(
+            cls.__name__, operations / update_time, operations / query_time))
+
+
+def benchmark_sparse(n=10 ** 6, points=20000, operations=10000):
+    '''Fill an n x n SparseMultidimensionalFenwickSumTree with random
+    points, then report the build time, the memory taken per point,
+    updates and box sums per second.
+    '''
+    import gc
+    import random
+    import time
+    import tracemalloc
+
+    rng = random.Random(1)
+    cells = {(rng.randrange(n), rng.randrange(n)): rng.randrange(1, 100) for i in range(points)}
+
+    tracemalloc.start()
+    sfst = SparseMultidimensionalFenwickSumTree([n, n], cells)
+    gc.collect()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    sfst = SparseMultidimensionalFenwickSumTree([n, n], cells)
+    print('build: {0:.2f} s, {1:.0f} bytes/point, {2} Fenwick nodes'.format(
+        time.perf_counter() - start, memory / len(cells), len(sfst.sum)))
+
+    start = time.perf_counter()
+    for i in range(operations):
+        sfst[rng.randrange(n)][rng.randrange(n)] += 1
+    update_time = time.perf_counter() - start
+
+    boxes = _random_boxes(rng, n, operations, dim=2)
+    start = time.perf_counter()
+    for (x1, x2), (y1, y2) in boxes:
+        sfst[x1:x2][y1:y2].sum()
+    query_time = time.perf_counter() - start
+    print('{0:.0f} updates/s, {1:.0f} queries/s'.format(operations / update_time, operations / query_time))
+
+
+def benchmark_operations(n=30, operations=20000):
+    '''Compare MultidimensionalFenwickSumTree with MultidimensionalFenwickTree
+    for int.__add__ and for xor on an n x n x n table: updates and box
+    queries per second.
+    '''
+    import operator
+    import random
+    import time
+
+    rng = random.Random(1)
+    table = [[[rng.randrange(10 ** 6) for i in range(n)] for j in range(n)] for k in range(n)]
+    points = [[rng.randrange(n) for i in range(3)] for j in range(operations)]
+    boxes = _random_boxes(rng, n, operations)
+
+    for name, mfst in [('sum tree', MultidimensionalFenwickSumTree(table)),
+                       ('int.__add__', MultidimensionalFenwickTree(table, int.__add__, operator.neg, 0)),
+                       ('xor', MultidimensionalFenwickTree(table, operator.xor, lambda x: x, 0))]:
+        start = time.perf_counter()
+        for x, y, z in points:
+            mfst[x][y][z] = x
+        update_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for (x1, x2), (y1, y2), (z1, z2) in boxes:
+            mfst[x1:x2][y1:y2][z1:z2].sum()
+        query_time = time.perf_counter() - start
+
+        print('{0}: {1:.0f} updates/s, {2:.0f} queries/s'.format(
+            name, operations / update_time, operations / query_time))
+
+
+def benchmark_kernels(n=50, operations=50000):
+    '''Run the main() workload on an n x n x n table with the generated
+    kernels and with the recursive walks they replace.
+    '''
+    import random
+    import time
+
+    rng = random.Random(1)
+    queries = []
+    for (x1, x2), (y1, y2), (z1, z2) in _random_boxes(rng, n, operations):
+        x, y, z = [rng.randrange(n) for i in range(3)]
+        queries.append((1, x, y, z, rng.randrange(-10 ** 6, 10 ** 6)))
+        # main() reads boxes with inclusive upper corners
+        queries.append((2, x1, y1, z1, x2 - 1, y2 - 1, z2 - 1))
+
+    max_unrolled_dim = MultidimensionalFenwickSumTree.MAX_UNROLLED_DIM
+    for name, unrolled in ('recursive walks', 0), ('generated kernels', max_unrolled_dim):
+        MultidimensionalFenwickSumTree.MAX_UNROLLED_DIM = unrolled
+        mfst = MultidimensionalFenwickSumTree([[[0] * n for i in range(n)] for j in range(n)])
+        MultidimensionalFenwickSumTree.MAX_UNROLLED_DIM = max_unrolled_dim
+
+        start = time.perf_counter()
+        for line in queries:
+            if line[0] == 1:
+                x, y, z, k = line[1:]
+                mfst[x][y][z] += k
+            else:
+                x1, y1, z1, x2, y2, z2 = line[1:]
+                mfst[x1:x2 + 1][y1:y2 + 1][z1:z2 + 1].sum()
+        print('{0}: {1:.0f} operations/s'.format(name, len(queries) / (time.perf_counter() - start)))
+
+
+def benchmark_mmap(n=100, operations=20000):
+    '''Compare building an n x n x n DenseMultidimensionalFenwickSumTree from
+    nested lists with mapping a saved one, then run box sums on the mapped
+    tree.
+    '''
+    import os
+    import random
+    import tempfile
+    import time
+
+    rng = random.Random(1)
+    table = [[[rng.randrange(10 ** 6) for i in range(n)] for j in range(n)] for k in range(n)]
+    start = time.perf_counter()
+    dfst = DenseMultidimensionalFenwickSumTree(table)
+    print('build: {0:.3f} s'.format(time.perf_counter() - start))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'table.fenwick')
+        dfst.save(path)
+        start = time.perf_counter()
+        mapped = DenseMultidimensionalFenwickSumTree.load(path)
+        print('load: {0:.6f} s for {1} bytes'.format(time.perf_counter() - start, os.path.getsize(path)))
+
+        boxes = _random_boxes(rng, n, operations)
+        start = time.perf_counter()
+        for (x1, x2), (y1, y2), (z1, z2) in boxes:
+            mapped[x1:x2][y1:y2][z1:z2].sum()
+        print('{0:.0f} queries/s on the mapped tree'.format(operations / (time.perf_counter() - start)))
+        del mapped
+
+
+def benchmark_threads(n=50, operations=20000, threads=(1, 2, 4, 8)):
+    '''Run the main() workload on an n x n x n
+    ConcurrentMultidimensionalFenwickSumTree from a growing number of
+    threads, each doing operations updates and queries, and report the
+    total throughput. Threads run in parallel only on a free-threaded
+    build of Python; with the GIL the throughput stays flat.
+    '''
+    import random
+    import sys
+    import threading
+    import time
+
+    def work(cfst, seed):
+        rng = random.Random(seed)
+        for (x1, x2), (y1, y2), (z1, z2) in _random_boxes(rng, n, operations):
+            cfst.add((rng.randrange(n), rng.randrange(n), rng.randrange(n)), 1)
+            cfst[x1:x2][y1:y2][z1:z2].sum()
+
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print('GIL enabled' if gil else 'free-threaded')
+    for count in threads:
+        cfst = ConcurrentMultidimensionalFenwickSumTree([[[0] * n for i in range(n)] for j in range(n)])
+        workers = [threading.Thread(target=work, args=(cfst, seed)) for seed in range(count)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        print('{0} threads: {1:.0f} operations/s'.format(
+            count, 2 * operations * count / (time.perf_counter() - start)))
+
+
 def main():
     global input
     global print
@@ -211,3 +1635,12 @@ if __name__ == '__main__':
     import doctest
     doctest.testmod()
     # main()
+    # benchmark_storage()
+    # benchmark_build()
+    # benchmark_batches()
+    # benchmark_range_updates()
+    # benchmark_sparse()
+    # benchmark_operations()
+    # benchmark_kernels()
+    # benchmark_mmap()
+    # benchmark_threads()
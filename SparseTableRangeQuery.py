@@ -7,6 +7,10 @@ class SparseTableRangeQuery:
     The construction of a table runs in O(n log n) time. 
     Each query runs in O(1) time.
     Memory overhead is (n log n).
+    With store_indices=True the levels above the values hold positions in
+    the array instead of values (4 or 8 bytes each), and argquery returns
+    the position of the result. Operation should return one of its
+    arguments then, as min and max do.
 
     >>> rmq = SparseTableRangeQuery([2, 4, 1, 7, 9, 8, 7, 6, 5], min)
     >>> rmq
@@ -25,8 +29,365 @@ class SparseTableRangeQuery:
     6
     >>> rmq.query(4, 9)
     5
+    >>> [int(i) for i in rmq.query_many([0, 0, 4, 4], [2, 5, 5, 9])]
+    [2, 1, 9, 5]
+    >>> SparseTableRangeQuery('abcab', max).query_many([0, 3], [2, 5])
+    ['b', 'b']
+    >>> SparseTableRangeQuery([1, 2.5, 2 ** 63], min).query(0, 3)
+    1
+    >>> rmq = SparseTableRangeQuery([2, 4, 1, 7, 9, 1, 7, 6, 5], min, store_indices=True)
+    >>> rmq.argquery(0, 9), rmq.argquery(3, 9), rmq.argquery(6, 9), rmq.query(6, 9)
+    (2, 5, 8, 5)
+    >>> SparseTableRangeQuery('abcab', max, store_indices=True).argquery(0, 5)
+    2
     '''
 
+    import array
+
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+
+    def __init__(self, iterable, operation, store_indices=False):
+        self.op = operation
+        self.store_indices = store_indices
+
+        if self.numpy is not None and operation in (min, max):
+            a = self._numeric_array(iterable)
+        else:
+            a = list(iterable)
+
+        assert len(a)
+
+        self.actual_length = len(a)
+
+        self.table = [a]
+        self.arrays = None
+        if isinstance(a, list) and store_indices:
+            typecode = 'i' if self.actual_length < 2 ** 31 else 'q'
+            previous = range(self.actual_length)
+            while 1 << len(self.table) <= self.actual_length:
+                half = 1 << (len(self.table) - 1)
+                self.table.append(self.array.array(typecode, [
+                    x if self.op(a[x], a[y]) == a[x] else y for x, y in zip(previous, previous[half:])]))
+                previous = self.table[-1]
+        elif isinstance(a, list):
+            while 1 << len(self.table) <= self.actual_length:
+                half = 1 << (len(self.table) - 1)
+                previous = self.table[-1]
+                self.table.append([self.op(x, y) for x, y in zip(previous, previous[half:])])
+        elif store_indices:
+            numpy = self.numpy
+            better = numpy.less if operation is min else numpy.greater
+            previous = numpy.arange(self.actual_length,
+                                    dtype=numpy.int32 if self.actual_length < 2 ** 31 else numpy.int64)
+            while 1 << len(self.table) <= self.actual_length:
+                half = 1 << (len(self.table) - 1)
+                left, right = previous[:-half], previous[half:]
+                # ties keep the left position
+                self.table.append(numpy.where(better(a[right], a[left]), right, left))
+                previous = self.table[-1]
+        else:
+            combine = self.numpy.minimum if operation is min else self.numpy.maximum
+            while 1 << len(self.table) <= self.actual_length:
+                half = 1 << (len(self.table) - 1)
+                previous = self.table[-1]
+                self.table.append(combine(previous[:-half], previous[half:]))
+        if not isinstance(a, list):
+            # items of a memoryview are plain Python numbers
+            self.arrays = self.table
+            self.table = [memoryview(level) for level in self.arrays]
+
+
+    @classmethod
+    def _numeric_array(cls, iterable):
+        '''Return the values as a one-dimensional NumPy array of the smallest
+        integer type that holds them, or of their floating type, or as a list
+        if NumPy can't hold them exactly: a mix of ints and floats, ints out
+        of the int64 range, types a memoryview can't read (float16). min and
+        max never produce new values, so every level fits in the same type.
+        '''
+        numpy = cls.numpy
+        if isinstance(iterable, numpy.ndarray):
+            values = iterable
+            if values.ndim != 1 or values.dtype.kind not in 'iu' and \
+                    values.dtype not in (numpy.float32, numpy.float64):
+                return list(values)
+        else:
+            values = list(iterable)
+            types = set(map(type, values))
+            if types == {int} and -2 ** 63 <= min(values) and max(values) < 2 ** 63:
+                values = numpy.array(values, dtype=numpy.int64)
+            elif types == {float}:
+                values = numpy.array(values, dtype=numpy.float64)
+            else:
+                return values
+        if not values.size:
+            return list(values)
+        if values.dtype.kind in 'iu':
+            values = values.astype(numpy.result_type(numpy.min_scalar_type(values.min()),
+                                                      numpy.min_scalar_type(values.max())))
+        return numpy.ascontiguousarray(values, dtype=values.dtype.newbyteorder('='))
+
+
+    def __repr__(self):
+        if '__objclass__' in dir(self.op):
+            methodname = self.op.__objclass__.__name__ + '.' + self.op.__name__
+        else:
+            methodname = self.op.__name__
+        return 'SparseTableRangeQuery({0}, {1})'.format(list(self.table[0]), methodname)
+
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self.table[0][index])
+        return self.table[0][index]
+
+
+    def query(self, query_left, query_right):
+        if self.store_indices:
+            return self.table[0][self.argquery(query_left, query_right)]
+        assert query_left < query_right
+        level = (query_right - query_left).bit_length() - 1
+        return self.op(self.table[level][query_left],
+                       self.table[level][query_right - (1 << level)])
+
+
+    def argquery(self, query_left, query_right):
+        '''Return the position of query(query_left, query_right) in the array,
+        the leftmost one if there are several.
+        '''
+        if not self.store_indices:
+            raise TypeError('argquery needs a table built with store_indices=True')
+        assert query_left < query_right
+        level = (query_right - query_left).bit_length() - 1
+        if not level:
+            return query_left
+        x = self.table[level][query_left]
+        y = self.table[level][query_right - (1 << level)]
+        values = self.table[0]
+        return x if self.op(values[x], values[y]) == values[x] else y
+
+
+    def query_many(self, lefts, rights):
+        '''Return the results of query(lefts[i], rights[i]) for every i.
+        For min and max over numbers the whole batch is answered with
+        vectorized gathers: the queries are grouped by level with a stable
+        sort, and each group is two gathers and one combine. The result is
+        a NumPy array then, a list otherwise.
+        '''
+        if self.store_indices and self.arrays is None:
+            return [self.query(query_left, query_right) for query_left, query_right in zip(lefts, rights)]
+        if self.arrays is None:
+            table = self.table
+            op = self.op
+            result = []
+            for query_left, query_right in zip(lefts, rights):
+                assert query_left < query_right
+                level = (query_right - query_left).bit_length() - 1
+                result.append(op(table[level][query_left], table[level][query_right - (1 << level)]))
+            return result
+
+        numpy = self.numpy
+        lefts = numpy.asarray(lefts, dtype=numpy.int64)
+        rights = numpy.asarray(rights, dtype=numpy.int64)
+        assert ((0 <= lefts) & (lefts < rights) & (rights <= self.actual_length)).all()
+        # frexp(x) = (m, e) with x == m * 2 ** e and 0.5 <= m < 1, exact below 2 ** 53
+        levels = (numpy.frexp(rights - lefts)[1] - 1).astype(numpy.int8)
+        order = numpy.argsort(levels, kind='stable')
+        bounds = numpy.cumsum(numpy.bincount(levels, minlength=len(self.arrays))).tolist()
+        lefts = lefts[order]
+        rights = rights[order]
+        combine = numpy.minimum if self.op is min else numpy.maximum
+        result = numpy.empty(len(order), dtype=self.arrays[0].dtype)
+        start = 0
+        for level, stop in enumerate(bounds):
+            if start < stop:
+                first = lefts[start:stop]
+                second = rights[start:stop] - (1 << level)
+                if self.store_indices and level:
+                    first = self.arrays[level][first]
+                    second = self.arrays[level][second]
+                    array = self.arrays[0]
+                else:
+                    array = self.arrays[level]
+                result[order[start:stop]] = combine(array[first], array[second])
+            start = stop
+        return result
+
+
+class BlockSparseTableRangeQuery:
+    '''Build the same immutable array as SparseTableRangeQuery with
+    near-linear memory overhead. Operation should return one of its
+    arguments, as min and max do.
+
+    The array is cut into blocks of 32 elements. A SparseTableRangeQuery
+    over the aggregates of the blocks answers the whole blocks of a query,
+    taking O((n / 32) log n) memory. Inside a block, masks[i] has bit j set
+    if element j of the block is the aggregate of the elements j..i,
+    strictly better than every element after it: the stack of the
+    candidates for the answer of a query ending at i. So the answer within a
+    block is the lowest bit of masks[i] at or above the start of the query.
+    Masks take 4 bytes per element, so the overhead is 4n bytes plus
+    (n / 32) log n references, far below the n log n of a full table.
+    The construction runs in near-linear time as well (vectorized if op
+    is min or max over numbers and NumPy is installed), each query runs in
+    O(1) time.
+
+    >>> rmq = BlockSparseTableRangeQuery([2, 4, 1, 7, 9, 8, 7, 6, 5] * 10, min)
+    >>> rmq.query(3, 9), rmq.query(3, 5), rmq.query(4, 90), rmq.query(1, 2)
+    (5, 7, 1, 4)
+    >>> rmq = BlockSparseTableRangeQuery('sparse table', max)
+    >>> rmq
+    BlockSparseTableRangeQuery(['s', 'p', 'a', 'r', 's', 'e', ' ', 't', 'a', 'b', 'l', 'e'], max)
+    >>> rmq.query(1, 4), rmq[-1]
+    ('r', 'e')
+    '''
+
+    import array
+
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+
+    # query has the block size of 32 = 1 << 5 inlined
+    BLOCK_BITS = 5
+    BLOCK = 1 << BLOCK_BITS
+
+    def __init__(self, iterable, operation):
+        self.op = operation
+        if self.numpy is not None and operation in (min, max):
+            values = SparseTableRangeQuery._numeric_array(iterable)
+        else:
+            values = list(iterable)
+        if isinstance(values, list):
+            self.values = values
+            assert self.values
+            self.masks = self.__build_masks(self.values)
+            blocks = [self.__aggregate(self.values[i:i + self.BLOCK])
+                      for i in range(0, len(self.values), self.BLOCK)]
+        else:
+            self.values = memoryview(values)
+            self.masks, blocks = self.__build_masks_numpy(values)
+            self.masks = memoryview(self.masks)
+        self.actual_length = len(self.values)
+        self.blocks = SparseTableRangeQuery(blocks, operation)
+
+
+    def __aggregate(self, values):
+        result = values[0]
+        for value in values[1:]:
+            result = self.op(result, value)
+        return result
+
+
+    def __build_masks(self, values):
+        masks = self.array.array('I')
+        stack = 0
+        for i, value in enumerate(values):
+            offset = i & (self.BLOCK - 1)
+            if not offset:
+                stack = 0
+            while stack:
+                top = stack.bit_length() - 1
+                if self.op(values[i - offset + top], value) != value:
+                    break
+                stack ^= 1 << top
+            stack |= 1 << offset
+            masks.append(stack)
+        return masks
+
+
+    def __build_masks_numpy(self, values):
+        '''Run the stacks of all the blocks at once, one offset at a time.
+        Return the masks and the aggregates of the blocks.
+        '''
+        numpy = self.numpy
+        combine = numpy.minimum if self.op is min else numpy.maximum
+        count = -(-len(values) // self.BLOCK)
+        # the last block is padded with its own last element
+        grid = numpy.concatenate([values, numpy.repeat(values[-1:], count * self.BLOCK - len(values))])
+        grid = grid.reshape(count, self.BLOCK)
+
+        masks = numpy.empty((count, self.BLOCK), dtype=numpy.uint32)
+        stack = numpy.zeros(count, dtype=numpy.uint32)
+        for offset in range(self.BLOCK):
+            value = grid[:, offset]
+            active = numpy.flatnonzero(stack)
+            while active.size:
+                # frexp(x)[1] - 1 is the index of the highest bit, exact below 2 ** 53
+                top = numpy.frexp(stack[active])[1] - 1
+                pop = combine(grid[active, top], value[active]) == value[active]
+                active = active[pop]
+                stack[active] ^= numpy.left_shift(numpy.uint32(1), top[pop].astype(numpy.uint32))
+                active = active[stack[active] != 0]
+            stack |= numpy.uint32(1 << offset)
+            masks[:, offset] = stack
+        return masks.reshape(-1)[:len(values)], combine.reduce(grid, axis=1)
+
+
+    def __repr__(self):
+        if '__objclass__' in dir(self.op):
+            methodname = self.op.__objclass__.__name__ + '.' + self.op.__name__
+        else:
+            methodname = self.op.__name__
+        return 'BlockSparseTableRangeQuery({0}, {1})'.format(list(self.values), methodname)
+
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self.values[index])
+        return self.values[index]
+
+
+    def query(self, query_left, query_right):
+        assert query_left < query_right
+        masks = self.masks
+        values = self.values
+        query_last = query_right - 1
+        left_block = query_left >> 5
+        right_block = query_last >> 5
+        if left_block == right_block:
+            mask = masks[query_last] >> (query_left & 31)
+            return values[query_left + (mask & -mask).bit_length() - 1]
+        mask = masks[left_block << 5 | 31] >> (query_left & 31)
+        result = values[query_left + (mask & -mask).bit_length() - 1]
+        op = self.op
+        if left_block + 1 < right_block:
+            level = (right_block - left_block - 1).bit_length() - 1
+            table = self.blocks.table[level]
+            result = op(op(result, table[left_block + 1]), table[right_block - (1 << level)])
+        mask = masks[query_last]
+        return op(result, values[(right_block << 5) + (mask & -mask).bit_length() - 1])
+
+
+class DisjointSparseTableRangeQuery:
+    '''Build an immutable array of fixed length with range queries for any
+    associative operation, not necessarily idempotent or commutative: sums,
+    products, concatenation, matrix multiplication.
+    On level h the array is cut into blocks of 2^h elements. Every block
+    stores the aggregates of the suffixes of its left half and of the
+    prefixes of its right half. A query [l, r] with l < r uses the level
+    where l and r fall into different halves of the same block, which is
+    the highest bit of l ^ r, so it calls the operation exactly once.
+    The construction of a table runs in O(n log n) time.
+    Each query runs in O(1) time.
+    Memory overhead is (n log n).
+
+    >>> rsq = DisjointSparseTableRangeQuery([2, 4, 1, 7, 9, 8, 7, 6, 5], int.__add__)
+    >>> rsq
+    DisjointSparseTableRangeQuery([2, 4, 1, 7, 9, 8, 7, 6, 5], int.__add__)
+    >>> rsq.query(0, 9), rsq.query(3, 6), rsq.query(4, 5), rsq[-1]
+    (49, 24, 9, 5)
+    >>> words = DisjointSparseTableRangeQuery('disjoint', str.__add__)
+    >>> words.query(2, 6), words.query(0, 8)
+    ('sjoi', 'disjoint')
+    '''
+
+    import itertools
+
     def __init__(self, iterable, operation):
         a = list(iterable)
         self.op = operation
@@ -34,32 +395,20 @@ class SparseTableRangeQuery:
         assert a
 
         self.actual_length = len(a)
-        self.pow2_length = 1
-        num_levels = 0
-        while self.pow2_length < self.actual_length:
-            self.pow2_length *= 2
-            num_levels += 1
-
-        tmp_level = -1
-        tmp_leftmost_bit = 0
-        self.level = [None]
-        self.leftmost_bit = [None]
-        for i in range(1, self.actual_length + 1):
-            if i & (i - 1) == 0:
-                tmp_level += 1
-                tmp_leftmost_bit = 2 ** tmp_level
-            self.level.append(tmp_level)
-            self.leftmost_bit.append(tmp_leftmost_bit)
-
         self.table = [a]
-        pow2 = 1
-        for i in range(1, num_levels + 1):
-            self.table.append([])
-            pow2 *= 2
-            j = 0
-            while j + pow2 <= self.actual_length:
-                self.table[i].append(self.op(self.table[i - 1][j], self.table[i - 1][j + pow2 // 2]))
-                j += 1        
+        for level in range(1, (self.actual_length - 1).bit_length() + 1):
+            half = 1 << (level - 1)
+            aggregates = []
+            for start in range(0, self.actual_length, 2 * half):
+                middle = start + half
+                if middle >= self.actual_length:
+                    # no query has its right end here
+                    aggregates.extend(a[start:])
+                    break
+                suffixes = self.itertools.accumulate(reversed(a[start:middle]), lambda x, y: operation(y, x))
+                aggregates.extend(reversed(list(suffixes)))
+                aggregates.extend(self.itertools.accumulate(a[middle:middle + half], operation))
+            self.table.append(aggregates)
 
 
     def __repr__(self):
@@ -67,7 +416,7 @@ class SparseTableRangeQuery:
             methodname = self.op.__objclass__.__name__ + '.' + self.op.__name__
         else:
             methodname = self.op.__name__
-        return 'SparseTableRangeQuery({0}, {1})'.format(self.table[0], methodname)
+        return 'DisjointSparseTableRangeQuery({0}, {1})'.format(self.table[0], methodname)
 
 
     def __getitem__(self, index):
@@ -76,12 +425,141 @@ class SparseTableRangeQuery:
 
     def query(self, query_left, query_right):
         assert query_left < query_right
-        diff = query_right - query_left
-        level = self.level[diff]
-        return self.op(self.table[level][query_left], 
-                       self.table[level][query_right - self.leftmost_bit[diff]])
+        query_last = query_right - 1
+        if query_left == query_last:
+            return self.table[0][query_left]
+        level = self.table[(query_left ^ query_last).bit_length()]
+        return self.op(level[query_left], level[query_last])
+
+
+def _main_array(n):
+    '''Return the numbers of main() for n and a0 = 1.'''
+    a = [0, 1]
+    for i in range(1, n):
+        a.append((23 * a[-1] + 21563) % 16714589)
+    return a
 
 
+def _random_ranges(n, queries):
+    '''Return a fixed list of random non-empty ranges [left, right) within n.'''
+    import random
+
+    rng = random.Random(1)
+    return [sorted(rng.sample(range(n + 1), 2)) for i in range(queries)]
+
+
+def _measure(name, build, query, ranges, n):
+    '''Print the time of build(), the memory taken by its result per one of
+    n elements and the rate of query(structure, left, right) over ranges.
+    '''
+    import gc
+    import time
+    import tracemalloc
+
+    start = time.perf_counter()
+    structure = build()
+    build_time = time.perf_counter() - start
+    del structure
+    gc.collect()
+
+    tracemalloc.start()
+    structure = build()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for left, right in ranges:
+        query(structure, left, right)
+    query_time = time.perf_counter() - start
+    print('{0}: build {1:.2f} s, {2:.1f} bytes/element, {3:.0f} queries/s'.format(
+        name, build_time, memory / n, len(ranges) / query_time))
+
+
+def benchmark_disjoint(n=100001, queries=100000):
+    '''Compare DisjointSparseTableRangeQuery with TreeRangeQuery on the
+    static array of TreeRangeQuery.main() for sums and for composition of
+    affine maps x -> a * x + b modulo a prime, which is not commutative.
+    '''
+    from TreeRangeQuery import TreeRangeQuery
+
+    MOD = 1000000007
+    def compose(f, g):
+        return f[0] * g[0] % MOD, (f[1] * g[0] + g[1]) % MOD
+
+    numbers = [i ** 2 % 12345 + i ** 3 % 23456 for i in range(n)]
+    maps = [(i ** 2 % 12345 + 1, i ** 3 % 23456) for i in range(n)]
+    ranges = _random_ranges(n, queries)
+
+    for name, a, operation in ('int.__add__', numbers, int.__add__), ('compose', maps, compose):
+        for cls in TreeRangeQuery, DisjointSparseTableRangeQuery:
+            _measure('{0}, {1}'.format(name, cls.__name__), lambda: cls(a, operation),
+                     cls.query, ranges, n)
+
+
+def benchmark_queries(n=10 ** 6, queries=10 ** 6):
+    '''Compare a loop of query with query_many on random ranges over n numbers
+    of main(), for min and for a Python function.
+    '''
+    import time
+
+    a = _main_array(n)
+    lefts, rights = map(list, zip(*_random_ranges(n, queries)))
+
+    for name, operation in ('min', min), ('lambda x, y: min(x, y)', lambda x, y: min(x, y)):
+        sparse = SparseTableRangeQuery(a, operation)
+        start = time.perf_counter()
+        for left, right in zip(lefts, rights):
+            sparse.query(left, right)
+        loop_time = time.perf_counter() - start
+        start = time.perf_counter()
+        sparse.query_many(lefts, rights)
+        batch_time = time.perf_counter() - start
+        print('{0}: query {1:.0f}/s, query_many {2:.0f}/s'.format(
+            name, queries / loop_time, queries / batch_time))
+        if sparse.arrays is not None:
+            left_array = sparse.numpy.array(lefts)
+            right_array = sparse.numpy.array(rights)
+            start = time.perf_counter()
+            sparse.query_many(left_array, right_array)
+            print('{0}: query_many {1:.0f}/s on NumPy arrays of bounds'.format(
+                name, queries / (time.perf_counter() - start)))
+
+
+def benchmark_memory(n=10 ** 6, queries=100000):
+    '''Compare SparseTableRangeQuery with BlockSparseTableRangeQuery on n
+    numbers of main() and min: build time, memory taken by the structure
+    and queries per second.
+    '''
+    a = _main_array(n)
+    ranges = _random_ranges(n, queries)
+    for cls in SparseTableRangeQuery, BlockSparseTableRangeQuery:
+        _measure(cls.__name__, lambda: cls(a, min), cls.query, ranges, n)
+
+
+def benchmark_argquery(n=10 ** 6, queries=100000):
+    '''Compare finding positions of minima with (value, index) tuples and
+    with store_indices=True on n numbers of main(): build time, memory
+    taken by the table and queries per second.
+    '''
+    a = _main_array(n)
+    ranges = _random_ranges(n, queries)
+    _measure('(value, index) tuples',
+             lambda: SparseTableRangeQuery([(value, i) for i, value in enumerate(a)], min),
+             lambda rmq, left, right: rmq.query(left, right)[1], ranges, n)
+    _measure('store_indices=True', lambda: SparseTableRangeQuery(a, min, store_indices=True),
+             SparseTableRangeQuery.argquery, ranges, n)
+
+
+def benchmark_build(n=10 ** 6, queries=100000):
+    '''Build a table over n numbers of main() with min on the NumPy fast
+    path and with a Python function on lists; report build time, memory
+    taken by the table and queries per second.
+    '''
+    a = _main_array(n)
+    ranges = _random_ranges(n, queries)
+    for name, operation in ('min', min), ('lambda x, y: min(x, y)', lambda x, y: min(x, y)):
+        _measure(name, lambda: SparseTableRangeQuery(a, operation), SparseTableRangeQuery.query, ranges, n)
+
 
 
 def read_ints():
@@ -119,4 +597,9 @@ def main():
 if __name__ == '__main__':
     #import doctest
     #doctest.testmod()
+    #benchmark_build()
+    #benchmark_queries()
+    #benchmark_memory()
+    #benchmark_argquery()
+    #benchmark_disjoint()
     main()
\ No newline at end of file
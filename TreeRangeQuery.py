@@ -4,6 +4,12 @@
 class TreeRangeQuery:
     '''Build an array of fixed length with fast implementation of range queries. 
     Items of an array should not be None. Operation should be associative.
+    It does not have to be commutative: query(l, r) combines the items
+    from left to right, op(...op(op(a[l], a[l + 1]), a[l + 2])..., a[r - 1]),
+    up to the placement of the parentheses.
+    The tree is stored bottom-up: the items are the leaves a[n:2n] and
+    a[i] = op(a[2i], a[2i + 1]), so no padding is needed for any n.
+    Queries and updates run in O(log n) time without recursion.
 
     >>> rsq = TreeRangeQuery([2, 4, 1, 7, 9], int.__add__)
     >>> rsq
@@ -28,6 +34,10 @@ class TreeRangeQuery:
     2
     >>> rmq.query(0, 5)
     1
+    >>> words = TreeRangeQuery('segment', str.__add__)
+    >>> words[-1] = 's'
+    >>> words.query(1, 7), words.query(3, 4)
+    ('egmens', 'm')
     '''
 
     def __init__(self, iterable, operation):
@@ -37,16 +47,9 @@ class TreeRangeQuery:
         assert self.a
 
         self.actual_length = len(self.a)
-        self.pow2_length = 1
-        while self.pow2_length < self.actual_length:
-            self.pow2_length *= 2
-
-        self.a = [None] * (self.pow2_length - 1) + self.a + [None] * (self.pow2_length - self.actual_length)
-        for i in range(self.pow2_length - 2, -1, -1):
-            if self.a[2 * i + 2] is not None:
-                self.a[i] = self.op(self.a[2 * i + 1], self.a[2 * i + 2])
-            elif self.a[2 * i + 1] is not None:
-                self.a[i] = self.a[2 * i + 1]
+        self.a = [None] * self.actual_length + self.a
+        for i in range(self.actual_length - 1, 0, -1):
+            self.a[i] = self.op(self.a[2 * i], self.a[2 * i + 1])
 
 
     def __repr__(self):
@@ -54,7 +57,7 @@ class TreeRangeQuery:
             methodname = self.op.__objclass__.__name__ + '.' + self.op.__name__
         else:
             methodname = self.op.__name__
-        return 'TreeRangeQuery({0}, {1})'.format(self.a[self.pow2_length - 1:self.pow2_length - 1 + self.actual_length], methodname)
+        return 'TreeRangeQuery({0}, {1})'.format(self.a[self.actual_length:], methodname)
 
 
     def __getitem__(self, index):
@@ -64,9 +67,9 @@ class TreeRangeQuery:
                 return self.a[index]
             else:
                 assert index < self.actual_length, 'Index out of bounds'
-                return self.a[index + self.pow2_length - 1]
+                return self.a[index + self.actual_length]
         elif isinstance(index, slice):
-            return list.__getitem__(self.a[self.pow2_length - 1:self.pow2_length - 1 + self.actual_length], index)
+            return list.__getitem__(self.a[self.actual_length:], index)
         else:
             raise TypeError()
 
@@ -75,39 +78,74 @@ class TreeRangeQuery:
         if isinstance(index, int):
             if index < 0:
                 assert -index <= self.actual_length, 'Index out of bounds'
-                index = self.pow2_length - index
+                index += self.actual_length
             else:
                 assert index < self.actual_length, 'Index out of bounds'
-            index += self.pow2_length - 1
-            self.a[index] = value
-            while index > 0:
-                index = (index - 1) // 2
-                if self.a[2 * index + 2] is not None:
-                    self.a[index] = self.op(self.a[2 * index + 1], self.a[2 * index + 2])                
-                else:
-                    self.a[index] = self.a[2 * index + 1]
+            a = self.a
+            op = self.op
+            index += self.actual_length
+            a[index] = value
+            index >>= 1
+            while index:
+                a[index] = op(a[2 * index], a[2 * index + 1])
+                index >>= 1
         else:
             raise TypeError()
 
 
-    def _query_recursion(self, query_left, query_right, index, actual_left, actual_right):
-        if query_left <= actual_left and actual_right <= query_right:
-            return self.a[index]
-        else:
-            mid = (actual_left + actual_right) // 2
-            if query_right <= mid:
-                return self._query_recursion(query_left, query_right, 2 * index + 1, actual_left, mid)
-            elif mid <= query_left:
-                return self._query_recursion(query_left, query_right, 2 * index + 2, mid, actual_right)
-            else:
-                return self.op(self._query_recursion(query_left, query_right, 2 * index + 1, actual_left, mid),
-                               self._query_recursion(query_left, query_right, 2 * index + 2, mid, actual_right))
+    def query(self, query_left, query_right):
+        assert 0 <= query_left < query_right <= self.actual_length
+        a = self.a
+        op = self.op
+        left = query_left + self.actual_length
+        right = query_right + self.actual_length
+        # the nodes on the left border are combined from left to right,
+        # the nodes on the right border from right to left
+        result_left = result_right = None
+        while left < right:
+            if left & 1:
+                result_left = a[left] if result_left is None else op(result_left, a[left])
+                left += 1
+            if right & 1:
+                right -= 1
+                result_right = a[right] if result_right is None else op(a[right], result_right)
+            left >>= 1
+            right >>= 1
+        if result_left is None:
+            return result_right
+        if result_right is None:
+            return result_left
+        return op(result_left, result_right)
+
+
+
+
+def benchmark(n=100001, operations=100000):
+    '''Measure the workload of main(): min and max trees over the same
+    array of n items, random range queries and point updates.
+    '''
+    import random
+    import time
 
+    rng = random.Random(1)
+    ranges = [sorted(rng.sample(range(n), 2)) for i in range(operations)]
+    updates = [(rng.randrange(n), rng.randrange(100000)) for i in range(operations)]
 
-    def query(self, query_left, query_right):
-        assert query_left < query_right
-        return self._query_recursion(query_left, query_right, 0, 0, self.pow2_length)
+    start = time.perf_counter()
+    rminq = TreeRangeQuery([i ** 2 % 12345 + i ** 3 % 23456 for i in range(n)], min)
+    rmaxq = TreeRangeQuery([i ** 2 % 12345 + i ** 3 % 23456 for i in range(n)], max)
+    print('build: {0:.2f} s'.format(time.perf_counter() - start))
+
+    start = time.perf_counter()
+    for x, y in ranges:
+        rmaxq.query(x, y + 1) - rminq.query(x, y + 1)
+    print('queries: {0:.0f} pairs/s'.format(operations / (time.perf_counter() - start)))
 
+    start = time.perf_counter()
+    for x, y in updates:
+        rminq[x] = y
+        rmaxq[x] = y
+    print('updates: {0:.0f} pairs/s'.format(operations / (time.perf_counter() - start)))
 
 
 
@@ -145,4 +183,5 @@ def main():
 if __name__ == '__main__':
     #import doctest
     #doctest.testmod()
+    #benchmark()
     main()
\ No newline at end of file